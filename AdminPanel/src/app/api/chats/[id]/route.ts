@@ -1,5 +1,6 @@
 import { NextRequest, NextResponse } from "next/server";
 import clientPromise from "@/util/mongodb";
+import { invalidateProcessingCache } from "@/util/messageProcessing";
 
 // Get chat by ID
 export async function GET(
@@ -66,6 +67,8 @@ export async function PATCH(
       }, { status: 404 });
     }
     
+    await invalidateProcessingCache('chats', id);
+    
     return NextResponse.json({
       success: true,
       updated: result.modifiedCount > 0
@@ -95,6 +98,8 @@ export async function DELETE(
       }, { status: 404 });
     }
     
+    await invalidateProcessingCache('chats', id);
+    
     return NextResponse.json({
       success: true,
       deleted: true
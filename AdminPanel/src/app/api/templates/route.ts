@@ -2,6 +2,7 @@
 import { NextRequest, NextResponse } from 'next/server';
 import { MongoClient, Db, Collection, ObjectId } from 'mongodb';
 import clientPromise from '@/util/mongodb'; // Adjust path if needed
+import { invalidateProcessingCache } from '@/util/messageProcessing';
 
 // Define the Template structure for the database
 interface TemplateDocument {
@@ -10,10 +11,34 @@ interface TemplateDocument {
     columns: string[];
     taskSplitPrompt: string;
     systemPrompt: string;
+    // Optional per-stage model overrides for the message processing service, e.g. { extract_csv: "yagpt-pro" }
+    stageModels?: Record<string, string>;
+    // Optional prompt files of the message processing service (name@version.txt), used when
+    // systemPrompt / taskSplitPrompt are empty; without a version the current one is used
+    promptName?: string;
+    promptVersion?: string;
+    splitPromptName?: string;
+    splitPromptVersion?: string;
     createdAt: Date;
     updatedAt: Date;
 }
 
+function isStageModels(value: unknown): value is Record<string, string> {
+    return typeof value === 'object' && value !== null && !Array.isArray(value) &&
+        Object.values(value).every(model => typeof model === 'string' && model.trim() !== '');
+}
+
+const PROMPT_FIELDS = ['promptName', 'promptVersion', 'splitPromptName', 'splitPromptVersion'] as const;
+
+// Prompt names and versions are parts of file names in the prompts directory
+function isPromptRef(value: unknown): value is string {
+    return typeof value === 'string' && /^[A-Za-z0-9_.-]+$/.test(value);
+}
+
+function pickPromptFields(body: any): Partial<Record<typeof PROMPT_FIELDS[number], string>> {
+    return Object.fromEntries(PROMPT_FIELDS.filter(field => body[field] !== undefined).map(field => [field, body[field]]));
+}
+
 let client: MongoClient;
 let db: Db;
 let templates: Collection<TemplateDocument>;
@@ -77,7 +102,7 @@ export async function GET(req: NextRequest): Promise<Response> {
             }
             return NextResponse.json(template);
         } else {
-            const allTemplates = await templates.find({}, { projection: { name: 1, _id: 1 } }).sort({ name: 1 }).toArray();
+            const allTemplates = await templates.find({}, { projection: { name: 1, _id: 1, updatedAt: 1 } }).sort({ name: 1 }).toArray();
             return NextResponse.json(allTemplates);
         }
     } catch (error: any) {
@@ -103,7 +128,7 @@ export async function POST(req: NextRequest): Promise<Response> {
             return NextResponse.json({ error: 'Invalid JSON body' }, { status: 400 });
         }
         
-        const { name, columns, taskSplitPrompt, systemPrompt } = body;
+        const { name, columns, taskSplitPrompt, systemPrompt, stageModels } = body;
 
         // Validation checks
         if (!name || typeof name !== 'string' || name.trim() === '' ||
@@ -113,6 +138,15 @@ export async function POST(req: NextRequest): Promise<Response> {
             return NextResponse.json({ error: 'Missing or invalid required fields (name, columns, taskSplitPrompt, systemPrompt)' }, { status: 400 });
         }
 
+        if (stageModels !== undefined && !isStageModels(stageModels)) {
+            return NextResponse.json({ error: 'stageModels must be an object mapping stage names to model names' }, { status: 400 });
+        }
+
+        const promptFields = pickPromptFields(body);
+        if (Object.values(promptFields).some(value => !isPromptRef(value))) {
+            return NextResponse.json({ error: `${PROMPT_FIELDS.join(', ')} must be names of letters, digits, '_', '.' or '-'` }, { status: 400 });
+        }
+
         if (columns.length === 0 || columns.some(col => typeof col !== 'string' || col.trim() === '')) {
              return NextResponse.json({ error: 'Columns array cannot be empty and must contain non-empty strings' }, { status: 400 });
         }
@@ -122,6 +156,8 @@ export async function POST(req: NextRequest): Promise<Response> {
             columns,
             taskSplitPrompt,
             systemPrompt,
+            ...(stageModels !== undefined && { stageModels }),
+            ...promptFields,
             createdAt: new Date(),
             updatedAt: new Date(),
         };
@@ -167,7 +203,7 @@ export async function PUT(req: NextRequest): Promise<Response> {
             return NextResponse.json({ error: 'Invalid JSON body' }, { status: 400 });
         }
         
-        const { name, columns, taskSplitPrompt, systemPrompt } = body;
+        const { name, columns, taskSplitPrompt, systemPrompt, stageModels } = body;
 
         // Validation logic 
         if (!name || typeof name !== 'string' || name.trim() === '' ||
@@ -177,6 +213,15 @@ export async function PUT(req: NextRequest): Promise<Response> {
             return NextResponse.json({ error: 'Missing or invalid required fields for update (name, columns, taskSplitPrompt, systemPrompt)' }, { status: 400 });
         }
         
+        if (stageModels !== undefined && !isStageModels(stageModels)) {
+            return NextResponse.json({ error: 'stageModels must be an object mapping stage names to model names' }, { status: 400 });
+        }
+
+        const promptFields = pickPromptFields(body);
+        if (Object.values(promptFields).some(value => !isPromptRef(value))) {
+            return NextResponse.json({ error: `${PROMPT_FIELDS.join(', ')} must be names of letters, digits, '_', '.' or '-'` }, { status: 400 });
+        }
+
         if (columns.length === 0 || columns.some(col => typeof col !== 'string' || col.trim() === '')) {
             return NextResponse.json({ error: 'Columns array cannot be empty and must contain non-empty strings' }, { status: 400 });
         }
@@ -186,6 +231,8 @@ export async function PUT(req: NextRequest): Promise<Response> {
             columns,
             taskSplitPrompt,
             systemPrompt,
+            ...(stageModels !== undefined && { stageModels }),
+            ...promptFields,
             updatedAt: new Date(),
         };
 
@@ -204,6 +251,7 @@ export async function PUT(req: NextRequest): Promise<Response> {
                 return NextResponse.json({ error: 'Template found but failed to retrieve after update.' }, { status: 500 });
             }
             
+            await invalidateProcessingCache('templates', id);
             return NextResponse.json(updatedTemplate);
         } catch (error: any) {
             console.error(`Error updating template ${id}:`, error);
@@ -242,6 +290,7 @@ export async function DELETE(req: NextRequest): Promise<Response> {
                 return NextResponse.json({ error: 'Template not found' }, { status: 404 });
             }
 
+            await invalidateProcessingCache('templates', id);
             return NextResponse.json({ message: 'Template deleted successfully' }, { status: 200 });
         } catch (error: any) {
             console.error(`Error deleting template ${id}:`, error);
@@ -0,0 +1,12 @@
+const MESSAGE_PROCESSING_SERVICE_URL = process.env.MESSAGE_PROCESSING_SERVICE_URL || 'http://localhost:8001';
+
+// Tell the message processing service to drop its cached copy of a chat or template
+export async function invalidateProcessingCache(kind: 'chats' | 'templates', id: string) {
+  try {
+    await fetch(`${MESSAGE_PROCESSING_SERVICE_URL}/cache/${kind}/${encodeURIComponent(id)}/invalidate`, {
+      method: 'POST',
+    });
+  } catch (error) {
+    console.error(`Failed to invalidate ${kind} cache:`, error);
+  }
+}
@@ -1,15 +1,28 @@
 import os
 import logging
 import asyncio
+import signal
 import aiohttp
-from fastapi import FastAPI, BackgroundTasks
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 from typing import Optional
 from dotenv import load_dotenv
 import traceback # For logging
 
 from src.whisper import transcribe_audio
-from src.agent import Agent
+from src.agent_store import AgentStore
+from src.job_queue import JobQueue
+from src.scheduler import BULK, INTERACTIVE, WeightedFairScheduler
+from src.sharding import SHARD_HEADER, ShardRouter
+from src.metrics import metrics
+from src.idempotency import IdempotencyStore
+from src.chat_cache import chat_cache
+from src.templates import TEMPLATE_REFRESH_INTERVAL, template_repository
+from src.prompts import prompt_registry
+from src.llm_cache import llm_cache
+from src.llm import LLM_HEALTH_CHECK_INTERVAL, balancer
+from src.accounting import tag_usage, usage
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -20,16 +33,69 @@ load_dotenv()
 
 app = FastAPI(title="Message Processing Service")
 
-agents = {}
-# Create a semaphore to limit concurrent background tasks
-task_semaphore = asyncio.Semaphore(5)
-
 # Environment variables
 API_PORT = int(os.getenv("API_PORT", 8001))
 # Ensure FILE_SERVICE_URL points to the base URL of your Next.js app (e.g., http://localhost:3000)
 FILE_SERVICE_URL = os.getenv("FILE_SERVICE_URL", "http://localhost:3000")
 LLM_SERVICE_URL = os.environ["LLM_SERVICE_URL"]
 DATA_SERVICE_URL = os.environ["DATA_SERVICE_URL"]
+# Durable job queue settings
+JOB_QUEUE_DB = os.getenv("JOB_QUEUE_DB", "data/jobs.db")
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", 5))
+JOB_VISIBILITY_TIMEOUT = float(os.getenv("JOB_VISIBILITY_TIMEOUT", 300))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", 5))
+# Processing budget of one message attempt (0 disables); past it the attempt is cancelled and retried
+MESSAGE_DEADLINE_SECONDS = float(os.getenv("MESSAGE_DEADLINE_SECONDS", 240))
+# Seconds to wait for running jobs on shutdown before checkpointing them back into the queue
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", 20))
+# Scheduling: workers kept free for private follow-up turns while private chats are active (bulk jobs
+# use them otherwise), the interactive wait SLO and per-chat weights ("chat_id:weight,...")
+RESERVED_INTERACTIVE_WORKERS = int(os.getenv("RESERVED_INTERACTIVE_WORKERS", 1))
+INTERACTIVE_SLO_SECONDS = float(os.getenv("INTERACTIVE_SLO_SECONDS", 30))
+CHAT_WEIGHTS = {
+    chat_id.strip(): float(weight)
+    for chat_id, weight in (item.rsplit(":", 1) for item in os.getenv("CHAT_WEIGHTS", "").split(",") if item.strip())
+}
+# Idempotency: messages already answered within the retention window are not processed again
+IDEMPOTENCY_DB = os.getenv("IDEMPOTENCY_DB", "data/idempotency.db")
+IDEMPOTENCY_RETENTION_HOURS = float(os.getenv("IDEMPOTENCY_RETENTION_HOURS", 72))
+# Burst coalescing: group messages of one sender arriving within DEBOUNCE_SECONDS of each other
+# are merged into one message before classification, up to DEBOUNCE_MAX_SECONDS after the first one
+DEBOUNCE_SECONDS = float(os.getenv("DEBOUNCE_SECONDS", 3))
+DEBOUNCE_MAX_SECONDS = float(os.getenv("DEBOUNCE_MAX_SECONDS", 15))
+# Admission limits: beyond them /new_message answers 503 / 429 with Retry-After
+MAX_QUEUE_DEPTH = int(os.getenv("MAX_QUEUE_DEPTH", 1000))
+MAX_INFLIGHT_PER_CHAT = int(os.getenv("MAX_INFLIGHT_PER_CHAT", 50))
+# Agent state store settings
+AGENT_STORE_DB = os.getenv("AGENT_STORE_DB", "data/agents.db")
+AGENT_CACHE_SIZE = int(os.getenv("AGENT_CACHE_SIZE", 1000))
+AGENT_CACHE_MAX_BYTES = int(os.getenv("AGENT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+AGENT_IDLE_TTL = float(os.getenv("AGENT_IDLE_TTL", 3600))
+AGENT_HISTORY_LIMIT = int(os.getenv("AGENT_HISTORY_LIMIT", 40))
+FOLLOW_UP_TTL = float(os.getenv("FOLLOW_UP_TTL", 3 * 24 * 3600))
+# "external" keeps no agent state in the process, so several workers can share AGENT_STORE_DB
+AGENT_STATE_MODE = os.getenv("AGENT_STATE_MODE", "memory")
+# Sender-affinity sharding: comma-separated base URLs of all nodes and the URL of this node
+SHARD_NODES = [node.strip() for node in os.getenv("SHARD_NODES", "").split(",") if node.strip()]
+SHARD_SELF = os.getenv("SHARD_SELF")
+# Timeout of forwarding a message to its owner node, and the Retry-After answered while the owner is unreachable
+SHARD_FORWARD_TIMEOUT = float(os.getenv("SHARD_FORWARD_TIMEOUT", 10))
+SHARD_RETRY_AFTER = int(os.getenv("SHARD_RETRY_AFTER", 10))
+
+agents = AgentStore(
+    AGENT_STORE_DB,
+    max_agents=AGENT_CACHE_SIZE,
+    max_bytes=AGENT_CACHE_MAX_BYTES,
+    idle_ttl=AGENT_IDLE_TTL,
+    max_history=AGENT_HISTORY_LIMIT,
+    follow_up_ttl=FOLLOW_UP_TTL,
+    external=AGENT_STATE_MODE == "external",
+)
+
+shard_router = ShardRouter(SHARD_NODES, SHARD_SELF)
+
+seen_messages = IdempotencyStore(IDEMPOTENCY_DB, retention=IDEMPOTENCY_RETENTION_HOURS * 3600)
 
 # --- Input Model ---
 class NewMessageRequest(BaseModel):
@@ -51,23 +117,18 @@ class NewMessageRequest(BaseModel):
 
 async def is_monitoring(chat_id: str) -> bool:
     """
-    Checks if a chat should be monitored by querying the Data Service.
+    Checks if a chat should be monitored using the cached chat metadata from the Data Service.
     Returns True if the chat is active and should be monitored, False otherwise.
     """
-    url = f"{DATA_SERVICE_URL}/api/chats/{chat_id}"
     try:
         logger.info(f"Checking monitoring status for chat: {chat_id}")
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    chat_data = await response.json()
-                    is_active = chat_data.get('active', False)
-                    logger.info(f"Chat {chat_id} active status: {is_active}")
-                    return is_active
-                else:
-                    error_text = await response.text()
-                    logger.error(f"Failed to fetch chat status for {chat_id}: {response.status} - {error_text}")
-                    return True  # Default to not monitoring if we can't fetch status
+        chat_data = await chat_cache.get(chat_id)
+        if chat_data is None:
+            logger.error(f"Chat {chat_id} not found in Data Service")
+            return True  # Default to monitoring if we can't fetch status
+        is_active = chat_data.get('active', False)
+        logger.info(f"Chat {chat_id} active status: {is_active}")
+        return is_active
     except aiohttp.ClientError as e:
         logger.error(f"HTTP Client Error fetching chat status for {chat_id}: {str(e)}")
         return True
@@ -75,15 +136,163 @@ async def is_monitoring(chat_id: str) -> bool:
         logger.error(f"Error checking monitoring status for chat {chat_id}: {traceback.format_exc()}")
         return True
 
-# --- Semaphore-protected wrapper for background tasks ---
-async def process_with_semaphore(agent, message):
+def owner_unavailable(message: NewMessageRequest) -> JSONResponse:
+    """
+    Answers that the node owning the message's sender can't take it right now,
+    asking the client to redeliver it later.
+    """
+    metrics.inc("message_admission_rejected_total", reason="owner_unavailable")
+    return JSONResponse(
+        {"status": "owner_unavailable", "message_id": message.message_id},
+        status_code=503,
+        headers={"Retry-After": str(SHARD_RETRY_AFTER)},
+    )
+
+async def forward_to_owner(owner: str, message: NewMessageRequest) -> Optional[JSONResponse]:
+    """
+    Forwards a message to the node owning its sender.
+    Returns the owner's response, or None if no connection to the owner could be made,
+    in which case the owner has certainly not received the message.
+    If the message may have reached the owner (timeouts, dropped connections, malformed answers),
+    the client is asked to redeliver it; the owner's idempotency store answers the redelivery.
+    """
+    url = f"{owner}/new_message"
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=SHARD_FORWARD_TIMEOUT)) as session:
+            async with session.post(url, json=message.model_dump(), headers={SHARD_HEADER: SHARD_SELF}) as response:
+                headers = {"Retry-After": response.headers["Retry-After"]} if "Retry-After" in response.headers else None
+                return JSONResponse(await response.json(), status_code=response.status, headers=headers)
+    except aiohttp.ClientConnectorError:
+        logger.error(f"Could not connect to {owner} to forward message {message.message_id}: {traceback.format_exc()}")
+        return None
+    except Exception:
+        logger.error(f"Error forwarding message {message.message_id} to {owner}, asking for redelivery: {traceback.format_exc()}")
+        return owner_unavailable(message)
+
+def merge_fragments(queued: dict, fragment: dict) -> Optional[dict]:
+    """
+    Merges a message fragment into the queued message of the same sender.
+    The merged message keeps the first message's id and lists the ids of all merged fragments.
+    Returns None if both carry an image, as a message holds only one; the fragment is then queued on its own.
+    """
+    if queued.get("image") and fragment.get("image"):
+        logger.info(f"Not merging message {fragment['message_id']} into {queued['message_id']}, both carry an image")
+        return None
+    merged = dict(queued)
+    texts = [text for text in (queued.get("text"), fragment.get("text")) if text]
+    merged["text"] = "\n".join(texts)
+    if not merged.get("image") and fragment.get("image"):
+        merged["image"] = fragment["image"]
+    merged["fragment_ids"] = [*queued.get("fragment_ids", [queued["message_id"]]), fragment["message_id"]]
+    return merged
+
+# --- Job queue handler ---
+async def process_job(payload: dict):
     """
-    Process a message with semaphore protection to limit concurrent tasks.
+    Processes a message taken from the job queue.
     """
-    async with task_semaphore:
-        logger.info(f"Starting processing for message {message.message_id} (active tasks: {5 - task_semaphore._value})")
+    message = NewMessageRequest(**payload)
+    tag_usage(chat_id=message.chat_id)
+    agent = agents.get(message.sender_id)
+    if payload.get("fragment_ids"):
+        logger.info(f"Starting processing for message {message.message_id}, merged from {', '.join(payload['fragment_ids'])}")
+    else:
+        logger.info(f"Starting processing for message {message.message_id}")
+    try:
         await agent.process_message(message)
-        logger.info(f"Completed processing message {message.message_id}")
+    finally:
+        agents.save(agent)
+    logger.info(f"Completed processing message {message.message_id}")
+
+async def evict_idle_agents():
+    """
+    Periodically drops idle agents from memory.
+    """
+    while True:
+        await asyncio.sleep(60)
+        try:
+            agents.evict_idle()
+        except Exception:
+            logger.error(f"Error evicting idle agents: {traceback.format_exc()}")
+
+async def purge_seen_messages():
+    """
+    Periodically forgets messages older than the idempotency retention window.
+    """
+    while True:
+        await asyncio.sleep(3600)
+        try:
+            seen_messages.purge()
+        except Exception:
+            logger.error(f"Error purging seen messages: {traceback.format_exc()}")
+
+async def purge_llm_cache():
+    """
+    Periodically drops expired cached LLM responses.
+    """
+    while True:
+        await asyncio.sleep(3600)
+        try:
+            llm_cache.purge()
+        except Exception:
+            logger.error(f"Error purging LLM responses: {traceback.format_exc()}")
+
+job_queue = JobQueue(
+    JOB_QUEUE_DB,
+    process_job,
+    workers=WORKER_COUNT,
+    visibility_timeout=JOB_VISIBILITY_TIMEOUT,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    backoff_base=JOB_RETRY_BACKOFF,
+    job_deadline=MESSAGE_DEADLINE_SECONDS,
+    scheduler=WeightedFairScheduler(
+        WORKER_COUNT,
+        reserved_interactive=RESERVED_INTERACTIVE_WORKERS,
+        interactive_slo=INTERACTIVE_SLO_SECONDS,
+        chat_weights=CHAT_WEIGHTS,
+    ),
+)
+
+@metrics.collector
+def collect_queue_metrics():
+    depth = job_queue.depth()
+    for status in ("queued", "running"):
+        metrics.set("message_queue_depth", depth[status], help="Jobs in the message queue by status", status=status)
+    metrics.set("message_queue_oldest_age_seconds", depth["oldest_queued_age"], help="Age of the oldest queued job")
+    stats = job_queue.wait_stats()
+    metrics.set("message_queue_wait_seconds", stats["avg_wait"], help="Average queue wait of recently started jobs")
+    metrics.set("message_queue_drain_rate", stats["drain_rate"], help="Jobs finished per second over the last 5 minutes")
+
+def check_admission(message: NewMessageRequest) -> Optional[JSONResponse]:
+    """
+    Rejects a message when the queue or its chat is over the admission limit.
+    Returns the rejection response, or None if the message is admitted.
+    """
+    if job_queue.draining:
+        logger.warning(f"Rejecting message {message.message_id}: service is shutting down")
+        return JSONResponse(
+            {"status": "shutting_down", "message_id": message.message_id},
+            status_code=503,
+            headers={"Retry-After": str(int(DRAIN_TIMEOUT) + 5)},
+        )
+
+    pending = job_queue.pending()
+    if pending >= MAX_QUEUE_DEPTH:
+        status_code, reason, backlog = 503, "queue_full", pending - MAX_QUEUE_DEPTH + 1
+    else:
+        chat_pending = job_queue.pending(message.chat_id)
+        if chat_pending < MAX_INFLIGHT_PER_CHAT:
+            return None
+        status_code, reason, backlog = 429, "chat_limit", chat_pending - MAX_INFLIGHT_PER_CHAT + 1
+
+    retry_after = job_queue.retry_after(backlog)
+    metrics.inc("message_admission_rejected_total", help="Messages rejected by admission control", reason=reason)
+    logger.warning(f"Rejecting message {message.message_id} from chat {message.chat_id} ({reason}), retry after {retry_after}s")
+    return JSONResponse(
+        {"status": reason, "message_id": message.message_id},
+        status_code=status_code,
+        headers={"Retry-After": str(retry_after)},
+    )
 
 # --- API Endpoints ---
 
@@ -93,45 +302,208 @@ async def startup_event():
     # load_config_from_data_service() # Keep if needed, but commented out as per original code
     logger.info("Message Processing Service started.")
     logger.info(f"Data Service URL: {FILE_SERVICE_URL}")
-    logger.info(f"LLM Service URL: {LLM_SERVICE_URL}")
+    logger.info(f"LLM Service URLs: {', '.join(backend.url for backend in balancer.backends)}")
+    if shard_router.enabled:
+        logger.info(f"Sharding by sender across {len(SHARD_NODES)} nodes, this node: {SHARD_SELF}")
+    await job_queue.start()
+    asyncio.create_task(evict_idle_agents())
+    asyncio.create_task(purge_seen_messages())
+    asyncio.create_task(purge_llm_cache())
+    try:
+        await template_repository.preload()
+    except Exception:
+        logger.error(f"Error preloading templates: {traceback.format_exc()}")
+    asyncio.create_task(template_repository.revalidate_periodically(TEMPLATE_REFRESH_INTERVAL))
+    logger.info(f"Prompts loaded: {prompt_registry.list()}")
+    if len(balancer.backends) > 1:
+        asyncio.create_task(balancer.check_periodically(LLM_HEALTH_CHECK_INTERVAL))
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, prompt_registry.reload)
+    except (NotImplementedError, RuntimeError):
+        # Not available on every platform; /prompts/reload still works
+        pass
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop admitting messages and drain the job queue"""
+    await job_queue.stop(drain_timeout=DRAIN_TIMEOUT)
+    await chat_cache.close()
+    await template_repository.close()
 
 
 # Removed /update endpoint as it wasn't used and load_config was commented out
 
 @app.post("/new_message")
-async def new_message(message: NewMessageRequest, background_tasks: BackgroundTasks):
+async def new_message(message: NewMessageRequest, request: Request):
     """
-    Receives a new message, forwards it immediately to the data service,
-    and then processes it with LLM in the background, sending an update.
+    Receives a new message and puts it on the durable job queue,
+    where a worker processes it with LLM and sends updates.
+    Messages of senders owned by another node are forwarded there.
     """
     logger.info(f"Received new message: ID {message.message_id} from {message.source_name}, chat_id: {message.chat_id}")
 
-    if message.voice:
-        message.text = transcribe_audio(message.voice)
-        print(message.text)
+    owner = shard_router.owner(message.sender_id)
+    if owner and SHARD_HEADER not in request.headers:
+        response = await forward_to_owner(owner, message)
+        if response is not None:
+            return response
+        if AGENT_STATE_MODE != "external":
+            # The owner holds the sender's conversation in memory; processing here would split it
+            logger.warning(f"Owner {owner} unavailable, rejecting message {message.message_id}")
+            return owner_unavailable(message)
+        # Agent state is shared in external mode, so the message can still be processed here
+        logger.warning(f"Owner {owner} unavailable, processing message {message.message_id} locally")
+
+    original_status = seen_messages.get(message.source_name, message.chat_id, message.message_id)
+    if original_status is not None:
+        logger.info(f"Duplicate message {message.message_id} from chat {message.chat_id}, answering with '{original_status}'")
+        metrics.inc("duplicate_messages_total", help="Redelivered messages answered from the idempotency store")
+        return {"status": original_status, "message_id": message.message_id, "duplicate": True}
+
+    rejection = check_admission(message)
+    if rejection is not None:
+        return rejection
+
+    # Recorded before any await, so a concurrent redelivery is recognized as a duplicate
+    seen_messages.record(message.source_name, message.chat_id, message.message_id, "received_processing_started")
+    try:
+        if message.voice:
+            message.text = transcribe_audio(message.voice)
+            print(message.text)
     
     
-    if not message.is_private and not await is_monitoring(message.chat_id)  :
-        logger.info(f"Chat {message.chat_id} is not active. Skipping processing.")
-        return {"status": "chat_not_active"}
+        if not message.is_private and not await is_monitoring(message.chat_id)  :
+            logger.info(f"Chat {message.chat_id} is not active. Skipping processing.")
+            seen_messages.record(message.source_name, message.chat_id, message.message_id, "chat_not_active")
+            return {"status": "chat_not_active"}
 
-    # Remove this
-    # if message.is_private:
-    #     return {"status": "chat_not_active"}
+        # Remove this
+        # if message.is_private:
+        #     return {"status": "chat_not_active"}
     
-    if message.sender_id not in agents:
-        logger.info(f"Creating new agent for sender: {message.sender_id}")
-        agents[message.sender_id] = Agent(message.sender_id)
-    
-    agent = agents[message.sender_id]
-    # Use the semaphore-protected wrapper
-    background_tasks.add_task(process_with_semaphore, agent, message)
+        # Messages of one sender share an Agent, so they run in order on one lane
+        job_options = dict(
+            message_id=message.message_id,
+            lane=message.sender_id or "",
+            chat_id=message.chat_id,
+            job_class=INTERACTIVE if message.is_private else BULK,
+        )
+        if not message.is_private and DEBOUNCE_SECONDS > 0:
+            # Reports are often sent as several messages in a row; classify them as one
+            job_queue.enqueue_coalesced(
+                message.model_dump(),
+                coalesce_key=f"{message.chat_id}:{message.sender_id}",
+                merge=merge_fragments,
+                window=DEBOUNCE_SECONDS,
+                max_window=DEBOUNCE_MAX_SECONDS,
+                **job_options,
+            )
+        else:
+            job_queue.enqueue(message.model_dump(), **job_options)
+    except BaseException:
+        # The message was not queued, so a redelivery has to be processed instead of answered as a duplicate
+        seen_messages.forget(message.source_name, message.chat_id, message.message_id)
+        raise
+
+    metrics.inc("message_admitted_total", help="Messages accepted for processing")
     
     return {
         "status": "received_processing_started",
         "message_id": message.message_id
     }
 
+@app.get("/queue")
+async def queue_depth():
+    """
+    Returns the number of queued, running, done and failed jobs.
+    """
+    return {**job_queue.depth(), **job_queue.wait_stats()}
+
+@app.get("/agents")
+async def agents_stats():
+    """
+    Returns the number of agents kept in memory and persisted follow-ups.
+    """
+    return agents.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Returns service metrics in the Prometheus text format.
+    """
+    return metrics.render()
+
+@app.get("/usage/chats")
+async def usage_by_chat(limit: int = 20):
+    """
+    Returns LLM calls, tokens and latency of the chats that spent the most tokens recently.
+    """
+    return usage.summaries(limit)
+
+@app.get("/usage/chats/{chat_id}")
+async def usage_of_chat(chat_id: str):
+    """
+    Returns LLM calls, tokens and latency of one chat by stage and model over the rolling window.
+    """
+    return usage.summary(chat_id)
+
+async def relay_to_shards(request: Request):
+    """
+    Repeats a cache invalidation request on the other shard nodes.
+    """
+    if not shard_router.enabled or SHARD_HEADER in request.headers:
+        return
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=SHARD_FORWARD_TIMEOUT)) as session:
+        for node in SHARD_NODES:
+            if node == SHARD_SELF:
+                continue
+            try:
+                async with session.post(f"{node}{request.url.path}", headers={SHARD_HEADER: SHARD_SELF}) as response:
+                    await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error(f"Failed to relay {request.url.path} to {node}: {str(e)}")
+
+@app.post("/cache/chats/invalidate")
+@app.post("/cache/chats/{chat_id}/invalidate")
+async def invalidate_chat_cache(request: Request, chat_id: Optional[str] = None):
+    """
+    Drops cached chat metadata, for one chat or for all chats.
+    Called by the Data Service when a chat's active flag or template changes.
+    Other shard nodes are notified as well.
+    """
+    chat_cache.invalidate(chat_id)
+    logger.info(f"Invalidated chat metadata cache for {chat_id or 'all chats'}")
+    await relay_to_shards(request)
+    return {"status": "invalidated", "chat_id": chat_id}
+
+@app.post("/cache/templates/invalidate")
+@app.post("/cache/templates/{template_id}/invalidate")
+async def invalidate_template_cache(request: Request, template_id: Optional[str] = None):
+    """
+    Drops cached templates, for one template or for all templates.
+    Called by the Data Service when a template is changed or deleted.
+    """
+    template_repository.invalidate(template_id)
+    logger.info(f"Invalidated template cache for {template_id or 'all templates'}")
+    await relay_to_shards(request)
+    return {"status": "invalidated", "template_id": template_id}
+
+@app.get("/prompts")
+async def list_prompts():
+    """
+    Returns the loaded prompts with their current and known versions.
+    """
+    return prompt_registry.list()
+
+@app.post("/prompts/reload")
+async def reload_prompts():
+    """
+    Rereads changed prompt files without a restart (same as SIGHUP).
+    """
+    reloaded = prompt_registry.reload()
+    return {"status": "reloaded", "prompts": reloaded}
+
 # --- Main Execution ---
 def main():
     import uvicorn
@@ -0,0 +1,177 @@
+import contextvars
+import os
+import time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from src.metrics import metrics
+
+# Per-chat usage summaries cover this many recent hours
+USAGE_WINDOW_HOURS = float(os.getenv("USAGE_WINDOW_HOURS", 24))
+
+# Chat and template the current task processes LLM calls for, set by the pipeline
+usage_labels: contextvars.ContextVar[Dict[str, str]] = contextvars.ContextVar("usage_labels", default={})
+# Labels of every task an LLM call is made for at once (a batched call), set by src.batching
+batch_usage_labels: contextvars.ContextVar[Optional[List[Dict[str, str]]]] = contextvars.ContextVar("batch_usage_labels", default=None)
+
+
+def tag_usage(**labels: Optional[str]):
+    """
+    Adds labels (chat_id, template_id) to LLM calls made by the current task from now on.
+    """
+    usage_labels.set({**usage_labels.get(), **{name: str(value) for name, value in labels.items() if value is not None}})
+
+
+class UsageAccounting:
+    """
+    Accounts tokens and latency of LLM calls by stage, model, chat and template.
+
+    Every call is exported as metrics and also kept per chat for a rolling
+    window, so the cost of one chat can be summarized without a metrics
+    backend. Calls answered from the response cache or by an identical
+    in-flight call are counted too, with no tokens, to show what they saved.
+    """
+
+    def __init__(self, window: float = 24 * 3600, max_events_per_chat: int = 10000):
+        self.window = window
+        self.max_events_per_chat = max_events_per_chat
+        self._events: Dict[str, Deque[Tuple]] = {}
+
+    def record(
+        self,
+        stage: str,
+        model: str,
+        source: str,
+        latency: float,
+        ttft: Optional[float] = None,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+    ):
+        """
+        Records one LLM call of the current task.
+
+        A batched call is recorded once for every task it was made for, each
+        with its share of the call and of the tokens.
+
+        Args:
+            stage: Pipeline stage of the call
+            model: Model the call was made for
+            source: "llm", "cache" or "shared" (answered by an identical in-flight call)
+            latency: Seconds until the whole answer was available
+            ttft: Seconds until the first token, if the answer was streamed
+            prompt_tokens: Prompt tokens billed for the call
+            completion_tokens: Completion tokens billed for the call
+        """
+        owners = batch_usage_labels.get() or [usage_labels.get()]
+        for index, labels in enumerate(owners):
+            self._record(
+                labels, 1 / len(owners), stage, model, source, latency, ttft,
+                _share(prompt_tokens, len(owners), index), _share(completion_tokens, len(owners), index),
+            )
+
+    def _record(
+        self,
+        labels: Dict[str, str],
+        share: float,
+        stage: str,
+        model: str,
+        source: str,
+        latency: float,
+        ttft: Optional[float],
+        prompt_tokens: int,
+        completion_tokens: int,
+    ):
+        chat_id = labels.get("chat_id", "")
+        template_id = labels.get("template_id", "")
+        tags = dict(stage=stage, model=model, chat_id=chat_id, template_id=template_id)
+
+        metrics.inc("llm_calls_total", share, help="LLM calls by stage, model, chat, template and source", source=source, **tags)
+        metrics.observe("llm_stage_latency_seconds", latency, help="Latency of LLM calls, retries included", source=source, **tags)
+        if prompt_tokens or completion_tokens:
+            metrics.inc("llm_tokens_total", prompt_tokens, help="Tokens spent on LLM calls", kind="prompt", **tags)
+            metrics.inc("llm_tokens_total", completion_tokens, kind="completion", **tags)
+        if ttft is not None:
+            metrics.observe("llm_time_to_first_token_seconds", ttft, help="Time to the first streamed token", stage=stage, model=model)
+
+        events = self._events.get(chat_id)
+        if events is None:
+            events = self._events[chat_id] = deque(maxlen=self.max_events_per_chat)
+        events.append((time.time(), stage, model, template_id, source, latency, ttft, prompt_tokens, completion_tokens))
+
+    def _expire(self, chat_id: str) -> Deque[Tuple]:
+        events = self._events.get(chat_id, deque())
+        cutoff = time.time() - self.window
+        while events and events[0][0] < cutoff:
+            events.popleft()
+        if not events:
+            self._events.pop(chat_id, None)
+        return events
+
+    def summary(self, chat_id: str) -> Dict[str, Any]:
+        """
+        Returns the calls, tokens and latency of a chat in the rolling window, in total and by stage and model.
+        """
+        totals = _Totals()
+        by_stage: Dict[Tuple[str, str], _Totals] = defaultdict(_Totals)
+        templates = set()
+        for _, stage, model, template_id, source, latency, ttft, prompt_tokens, completion_tokens in self._expire(chat_id):
+            for bucket in (totals, by_stage[stage, model]):
+                bucket.add(source, latency, ttft, prompt_tokens, completion_tokens)
+            if template_id:
+                templates.add(template_id)
+        return {
+            "chat_id": chat_id,
+            "window_seconds": self.window,
+            "template_ids": sorted(templates),
+            **totals.to_dict(),
+            "stages": [{"stage": stage, "model": model, **bucket.to_dict()} for (stage, model), bucket in sorted(by_stage.items())],
+        }
+
+    def summaries(self, limit: int = 20) -> list:
+        """
+        Returns the summaries of the chats that spent the most tokens in the rolling window.
+        """
+        chats = [self.summary(chat_id) for chat_id in list(self._events)]
+        chats = [chat for chat in chats if chat["calls"]]
+        return sorted(chats, key=lambda chat: chat["prompt_tokens"] + chat["completion_tokens"], reverse=True)[:limit]
+
+
+def _share(total: int, owners: int, index: int) -> int:
+    """
+    Returns the part of total falling to one of several owners, the remainder going to the first ones.
+    """
+    return total // owners + (1 if index < total % owners else 0)
+
+
+class _Totals:
+    __slots__ = ("calls", "llm_calls", "latency", "ttft", "ttft_calls", "prompt_tokens", "completion_tokens")
+
+    def __init__(self):
+        self.calls = self.llm_calls = self.ttft_calls = 0
+        self.latency = self.ttft = 0.0
+        self.prompt_tokens = self.completion_tokens = 0
+
+    def add(self, source: str, latency: float, ttft: Optional[float], prompt_tokens: int, completion_tokens: int):
+        self.calls += 1
+        self.latency += latency
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        if source == "llm":
+            self.llm_calls += 1
+        if ttft is not None:
+            self.ttft_calls += 1
+            self.ttft += ttft
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "llm_calls": self.llm_calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "latency_seconds": round(self.latency, 3),
+            "avg_latency_seconds": round(self.latency / self.calls, 3) if self.calls else None,
+            "avg_ttft_seconds": round(self.ttft / self.ttft_calls, 3) if self.ttft_calls else None,
+        }
+
+
+usage = UsageAccounting(window=USAGE_WINDOW_HOURS * 3600)
@@ -1,8 +1,10 @@
+import asyncio
 import logging
 import os
 import json
+import time
 from pydantic import BaseModel, Field
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
 from dotenv import load_dotenv
 import aiohttp
 import traceback  # For logging
@@ -13,10 +15,17 @@ from src.data_lists import CULTURES, DIVISIONS, OPERATIONS
 from src.scenario import (
     extract_data_from_message,
     is_report,
+    split_with_template,
     agentic,
     get_history_for_followup,
     determine_questions,
+    stage_model,
 )
+from src.job_queue import checkpointed, has_checkpoint
+from src.accounting import tag_usage
+from src.metrics import metrics
+from src import report_rules
+from src.deadline import call_timeout
 from src.util import dict_to_csv_string, generate_table_image, extract_questions, parse_table_from_message
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -32,6 +41,14 @@ LLM_SERVICE_URL = os.environ["LLM_SERVICE_URL"]
 WHATSAPP_SERVICE_URL = os.getenv("WHATSAPP_SERVICE_URL", "http://localhost:52101")
 FILE_SERVICE_URL = os.getenv("FILE_SERVICE_URL", "http://localhost:52001")
 
+# Timeout of outbound HTTP calls, shortened to the remaining message deadline
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 300))
+
+# Start split_report alongside classification for messages whose lexicon score is at least
+# SPECULATIVE_SPLIT_SCORE; the split is cancelled if the message turns out not to be a report
+SPECULATIVE_SPLIT = os.getenv("SPECULATIVE_SPLIT", "false").lower() in ("1", "true", "yes")
+SPECULATIVE_SPLIT_SCORE = float(os.getenv("SPECULATIVE_SPLIT_SCORE", 3))
+
 # Path to store failed attempts
 FAILED_LIST_PATH = "../failed_list.json"
 
@@ -71,40 +88,51 @@ class SaveServicePayload(BaseModel):
     extra: Dict[str, Any] = Field(default_factory=dict)
 
 class Agent:
+    # Agents are kept per sender for a whole season, so keep the records compact
+    __slots__ = ("state", "user", "history", "original_report_message", "last_active")
+
     def __init__(self, user):
         self.state = "NONE"
         self.user = user
         self.history = []
         self.original_report_message = None
+        self.last_active = 0.0
 
-    async def process_chat_message(self, message):
-        await self.process_and_update_in_background(message)
+    async def process_chat_message(self, message, speculation: Optional[asyncio.Task] = None):
+        await self.process_and_update_in_background(message, speculation)
         logger.info(f"Scheduled background LLM processing for message {message.message_id}")
 
     async def process_message(self, message):
         if not message.is_private:
-            if await is_report(message.text):
-                initial_payload = DataServicePayload(
-                    message_id=message.message_id,
-                    source_name=message.source_name,
-                    chat_id=message.chat_id,
-                    text=message.text,
-                    sender_id=message.sender_id,
-                    sender_name=message.sender_name,
-                    image=message.image,
-                    data=None,
-                    is_private=message.is_private,
-                )
-                await self.send_to_data_service_new_message(initial_payload)
-                await self.process_chat_message(message)
+            report, speculation = await self.classify(message)
+            try:
+                if report:
+                    initial_payload = DataServicePayload(
+                        message_id=message.message_id,
+                        source_name=message.source_name,
+                        chat_id=message.chat_id,
+                        text=message.text,
+                        sender_id=message.sender_id,
+                        sender_name=message.sender_name,
+                        image=message.image,
+                        data=None,
+                        is_private=message.is_private,
+                    )
+                    await checkpointed("forwarded", lambda: self.send_to_data_service_new_message(initial_payload))
+                    await self.process_chat_message(message, speculation)
+            finally:
+                # Whatever ends the job before process_report awaits the split must not leave it running
+                if speculation is not None:
+                    speculation.cancel()
         else:
-            if self.state == "FOLLOW_UP":
-                result = await agentic(self.history, message.text)
+            # A resumed job takes the branch its first attempt took, whatever state was saved since
+            state = await checkpointed("state", self.get_state)
+            if state == "FOLLOW_UP":
+                result = await checkpointed("follow_up_agentic", lambda: agentic(list(self.history), message.text))
                 self.history = result["history"]
                 answer = result["answer"]
                 table = parse_table_from_message(answer)
                 if len(table) > 0:
-                    self.state = "NONE"
                     update_payload = DataServicePayload(
                         message_id=self.original_report_message.message_id,
                         source_name=self.original_report_message.source_name,
@@ -116,35 +144,97 @@ class Agent:
                         data=table,
                         is_private=self.original_report_message.is_private,
                     )
-                    await self.send_to_data_service_new_message(update_payload)
-                    await self.direct_message("Спасибо, ваш отчёт был записан!")
+                    await checkpointed("follow_up_updated", lambda: self.send_to_data_service_new_message(update_payload))
+                    await checkpointed("follow_up_answered", lambda: self.direct_message("Спасибо, ваш отчёт был записан!"))
+                    self.state = "NONE"
                 else:
-                    await self.direct_message(answer)
+                    await checkpointed("follow_up_answered", lambda: self.direct_message(answer))
             else:
-                if await is_report(message.text):
-                    initial_payload = DataServicePayload(
-                        message_id=message.message_id,
-                        source_name=message.source_name,
-                        chat_id=message.chat_id,
-                        text=message.text,
-                        sender_id=message.sender_id,
-                        sender_name=message.sender_name,
-                        image=message.image,
-                        data=None,
-                        is_private=message.is_private,
-                    )
-                    await self.send_to_data_service_new_message(initial_payload)
-                    await self.process_chat_message(message)
-                else:
-                    result = await agentic(self.history, message.text)
-                    self.history = result["history"]
-                    await self.direct_message(result["answer"])
+                report, speculation = await self.classify(message)
+                try:
+                    if report:
+                        initial_payload = DataServicePayload(
+                            message_id=message.message_id,
+                            source_name=message.source_name,
+                            chat_id=message.chat_id,
+                            text=message.text,
+                            sender_id=message.sender_id,
+                            sender_name=message.sender_name,
+                            image=message.image,
+                            data=None,
+                            is_private=message.is_private,
+                        )
+                        await checkpointed("forwarded", lambda: self.send_to_data_service_new_message(initial_payload))
+                        await self.process_chat_message(message, speculation)
+                    else:
+                        result = await checkpointed("agentic", lambda: agentic(list(self.history), message.text))
+                        self.history = result["history"]
+                        await checkpointed("answered", lambda: self.direct_message(result["answer"]))
+                finally:
+                    if speculation is not None:
+                        speculation.cancel()
+
+    async def get_state(self) -> str:
+        return self.state
+
+    async def classify(self, message: NewMessageRequest) -> Tuple[bool, Optional[asyncio.Task]]:
+        """
+        Determines if a message is a report, splitting it speculatively in the meantime
+        if SPECULATIVE_SPLIT is on and the message looks like a report.
+
+        Returns:
+            Whether the message is a report, and for a report the task of the speculative split if one was started
+        """
+        speculation = self.speculate_split(message)
+        started_at = time.monotonic()
+        try:
+            report = await checkpointed("is_report", lambda: is_report(message.text))
+        except BaseException:
+            if speculation is not None:
+                speculation.cancel()
+            raise
+        if speculation is None:
+            return report, None
+
+        classified_in = time.monotonic() - started_at
+        if not report:
+            speculation.cancel()
+            metrics.inc("speculative_split_total", help="Speculative splits by outcome", outcome="wasted")
+            metrics.inc("speculative_split_wasted_seconds_total", classified_in, help="Seconds speculative splits ran before being cancelled")
+            return report, None
+
+        def record_saved(task: asyncio.Task):
+            # The split overlapped classification for as long as both ran
+            if not task.cancelled() and task.exception() is None:
+                saved = min(time.monotonic() - started_at, classified_in)
+                metrics.inc("speculative_split_total", outcome="used")
+                metrics.inc("speculative_split_saved_seconds_total", saved, help="Latency saved by splitting during classification")
+
+        speculation.add_done_callback(record_saved)
+        return report, speculation
+
+    def speculate_split(self, message: NewMessageRequest) -> Optional[asyncio.Task]:
+        """
+        Starts splitting a message that looks like a report, or returns None.
+        """
+        if not SPECULATIVE_SPLIT or has_checkpoint("is_report") or has_checkpoint("extraction"):
+            return None
+        if report_rules.score(message.text) < SPECULATIVE_SPLIT_SCORE:
+            return None
+
+        async def split():
+            template_id = await get_template_id(message.chat_id)
+            tag_usage(template_id=template_id)
+            template = await get_template_by_id(template_id)
+            return await split_with_template(message.text, template)
+
+        return asyncio.create_task(split())
 
     async def direct_message(self, text):
         url = f"{WHATSAPP_SERVICE_URL}/send_message"
         try:
             payload = {"user": self.user, "text": text}
-            async with aiohttp.ClientSession() as session:
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=call_timeout(HTTP_TIMEOUT))) as session:
                 async with session.post(url, json=payload) as response:
                     if response.status == 200:
                         return True
@@ -159,7 +249,7 @@ class Agent:
         url = f"{WHATSAPP_SERVICE_URL}/send_image"
         try:
             payload = {"user": self.user, "image": image}
-            async with aiohttp.ClientSession() as session:
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=call_timeout(HTTP_TIMEOUT))) as session:
                 async with session.post(url, json=payload) as response:
                     if response.status == 200:
                         return True
@@ -176,7 +266,7 @@ class Agent:
             payload_dict = payload.model_dump(exclude_none=True) if hasattr(payload, 'model_dump') else payload.dict(exclude_none=True)
             log_prefix = "Forwarding initial" if payload.data is None else "Sending LLM update for"
             logger.info(f"{log_prefix} message to Data Service for message {payload.message_id}")
-            async with aiohttp.ClientSession() as session:
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=call_timeout(HTTP_TIMEOUT))) as session:
                 async with session.post(url, json=payload_dict) as response:
                     if response.status in (200, 201):
                         return True
@@ -187,14 +277,25 @@ class Agent:
             logger.error(f"Error sending data to Data Service for message {payload.message_id}: {traceback.format_exc()}")
             return False
 
-    async def process_and_update_in_background(self, message: NewMessageRequest):
+    async def process_and_update_in_background(self, message: NewMessageRequest, speculation: Optional[asyncio.Task] = None):
         logger.info(f"[Background Task] Starting LLM processing for message {message.message_id}")
-        await self.process_report(message)
+        await self.process_report(message, speculation)
 
-    async def process_report(self, message: NewMessageRequest) -> Dict[str, Any]:
+    async def process_report(self, message: NewMessageRequest, speculation: Optional[asyncio.Task] = None) -> Dict[str, Any]:
         try:
-            template = get_template_by_id(await get_template_id(message.chat_id))
-            result: List[Dict[str, Any]] = await extract_data_from_message(message.text, template)
+            template_id = await get_template_id(message.chat_id)
+            tag_usage(template_id=template_id)
+            template = await get_template_by_id(template_id)
+            split = None
+            if speculation is not None:
+                try:
+                    split = await speculation
+                except Exception:
+                    logger.error(f"Speculative split failed, splitting again: {traceback.format_exc()}")
+                    metrics.inc("speculative_split_total", outcome="failed")
+            result: List[Dict[str, Any]] = await checkpointed(
+                "extraction", lambda: extract_data_from_message(message.text, template, split)
+            )
             parsed_rows = []
             success = True
             for row in result:
@@ -234,8 +335,9 @@ class Agent:
                 data=parsed_rows,
                 is_private=message.is_private,
             )
-            data_service_success = await self.send_to_data_service_new_message(update_payload)
-            save_service_success = await self.send_to_save_service(message, parsed_rows)
+            # A resumed job must not post the rows again; the save service would store them twice
+            data_service_success = await checkpointed("updated", lambda: self.send_to_data_service_new_message(update_payload))
+            save_service_success = await checkpointed("saved", lambda: self.send_to_save_service(message, parsed_rows))
             if data_service_success:
                 logger.info(f"Successfully sent LLM update for message {message.message_id}")
             if save_service_success:
@@ -261,16 +363,19 @@ class Agent:
                 except Exception:
                     logger.error(f"Error saving failed attempt: {traceback.format_exc()}")
 
-                await self.ask_for_follow_up(message, result)
+                await self.ask_for_follow_up(message, result, template)
         except Exception:
             logger.error(f"Error processing with LLM: {traceback.format_exc()}")
             return {}
+        finally:
+            if speculation is not None:
+                speculation.cancel()
 
     async def send_to_save_service(self, message: NewMessageRequest, data: List[Dict[str, Any]], setting_id: int = 1):
         url = f"{FILE_SERVICE_URL}/api/setting/{setting_id}/message_pending"
         try:
             template_id = await get_template_id(message.chat_id)
-            template = get_template_by_id(template_id)
+            template = await get_template_by_id(template_id)
             cols = template["columns"]
             formatted_message_text = {col: [] for col in cols}
             row_count = len(data)
@@ -290,19 +395,14 @@ class Agent:
                 "images": {"images": [] if not message.image else [message.image]},
                 "extra": {"testing": True, "datetime" : message.datetime},
             }
-            async with aiohttp.ClientSession() as session:
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=call_timeout(HTTP_TIMEOUT))) as session:
                 async with session.post(url, json=payload) as response:
                     return response.status in (200, 201)
         except Exception:
             logger.error(f"Error sending data to Save Service for message {message.message_id}: {traceback.format_exc()}")
             return False
 
-    async def ask_for_follow_up(self, message: NewMessageRequest, result: Any) -> Dict[str, Any]:
-        self.state = "FOLLOW_UP"
-        self.original_report_message = message
-        table_image_url = generate_table_image(result)
-        table_csv = dict_to_csv_string(result)
-        questions = await determine_questions(table_csv)
+    async def send_follow_up(self, table_image_url: Optional[str], questions: Optional[str]) -> bool:
         await self.direct_message("Добрый день! Я обработал ваш недавний отчёт, но возникли некоторые трудности.")
         if table_image_url:
             await self.direct_image(table_image_url)
@@ -311,5 +411,16 @@ class Agent:
             await self.direct_message(questions)
         else:
             await self.direct_message("Я не смог выделить из него каких-либо данных. Пожалуйста, пришлите отчёт заново в стандартном формате. Если вы не отправляли никаких сообщений, просто игнорируйте это сообщение.")
-        self.history = await get_history_for_followup(table_csv, questions)
+        return True
+
+    async def ask_for_follow_up(self, message: NewMessageRequest, result: Any, template: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        table_image_url = generate_table_image(result)
+        table_csv = dict_to_csv_string(result)
+        questions = await checkpointed("questions", lambda: determine_questions(table_csv, stage_model("determine_questions", template)))
+        await checkpointed("follow_up_sent", lambda: self.send_follow_up(table_image_url, questions))
+        history = await get_history_for_followup(table_csv, questions)
+        # Only once the user has been asked, so an interrupted attempt is resumed instead of read as the answer
+        self.state = "FOLLOW_UP"
+        self.original_report_message = message
+        self.history = history
         return {"status": "follow-up-requested"}
@@ -0,0 +1,190 @@
+import json
+import logging
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from src.agent import Agent, NewMessageRequest
+from src.db import connect
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS agents (
+    sender_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    history TEXT NOT NULL,
+    original_report_message TEXT,
+    updated_at REAL NOT NULL
+);
+"""
+
+# Rough per-agent overhead on top of the history contents
+AGENT_BASE_SIZE = 512
+
+
+def _agent_size(agent: Agent) -> int:
+    return AGENT_BASE_SIZE + sum(sys.getsizeof(m.get("content") or "") for m in agent.history)
+
+
+class AgentStore:
+    """
+    Keeps per-sender Agents in a bounded in-memory LRU and persists pending
+    follow-up conversations to SQLite.
+
+    Hot agents live in memory until they have been idle for idle_ttl seconds
+    or the LRU runs over max_agents / max_bytes. Agents waiting for a
+    FOLLOW_UP answer are written through to SQLite whenever they are saved,
+    so they can be evicted from memory and survive restarts; agents in the
+    NONE state carry nothing worth keeping and are simply dropped.
+
+    In external mode nothing is cached in memory: every agent is read from
+    and written back to the database, so several worker processes sharing
+    the database file can pick up any sender's conversation.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_agents: int = 1000,
+        max_bytes: int = 64 * 1024 * 1024,
+        idle_ttl: float = 3600.0,
+        max_history: int = 40,
+        follow_up_ttl: float = 3 * 24 * 3600,
+        external: bool = False,
+    ):
+        self.external = external
+        self.max_agents = max_agents
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.max_history = max_history
+        self.follow_up_ttl = follow_up_ttl
+
+        self.conn = connect(path)
+        self.conn.executescript(SCHEMA)
+
+        self._agents: "OrderedDict[Optional[str], Agent]" = OrderedDict()
+        self._sizes: Dict[Optional[str], int] = {}
+        self._bytes = 0
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def get(self, sender_id: Optional[str]) -> Agent:
+        """
+        Returns the Agent of a sender, loading a spilled follow-up
+        conversation or creating a fresh agent when it is not in memory.
+        """
+        if self.external:
+            self.loads += 1
+            agent = self._load(sender_id) or Agent(sender_id)
+            agent.last_active = time.time()
+            return agent
+
+        agent = self._agents.get(sender_id)
+        if agent is not None:
+            self.hits += 1
+            self._agents.move_to_end(sender_id)
+        else:
+            agent = self._load(sender_id)
+            if agent is None:
+                logger.info(f"Creating new agent for sender: {sender_id}")
+                agent = Agent(sender_id)
+            else:
+                self.loads += 1
+                logger.info(f"Restored {agent.state} conversation for sender: {sender_id}")
+            self._put(sender_id, agent)
+            self._shrink()
+
+        agent.last_active = time.time()
+        return agent
+
+    def save(self, agent: Agent):
+        """
+        Records an agent after it processed a message: trims its history,
+        re-accounts its size and writes or clears its persisted follow-up.
+        """
+        if len(agent.history) > self.max_history:
+            # Keep the system prompt and the most recent turns
+            agent.history = agent.history[:1] + agent.history[-(self.max_history - 1):]
+
+        agent.last_active = time.time()
+        if not self.external:
+            self._put(agent.user, agent)
+
+        if agent.state == "FOLLOW_UP" or (self.external and agent.history):
+            self.conn.execute(
+                """
+                INSERT OR REPLACE INTO agents (sender_id, state, history, original_report_message, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (
+                    agent.user or "",
+                    agent.state,
+                    json.dumps(agent.history, ensure_ascii=False),
+                    agent.original_report_message.model_dump_json() if agent.original_report_message else None,
+                    agent.last_active,
+                ),
+            )
+        else:
+            self.conn.execute("DELETE FROM agents WHERE sender_id = ?", (agent.user or "",))
+
+        self._shrink()
+
+    def evict_idle(self):
+        """
+        Drops agents idle for longer than idle_ttl and expires persisted
+        follow-ups nobody answered within follow_up_ttl.
+        """
+        cutoff = time.time() - self.idle_ttl
+        idle = [sender_id for sender_id, agent in self._agents.items() if agent.last_active < cutoff]
+        for sender_id in idle:
+            self._evict(sender_id)
+
+        self.conn.execute("DELETE FROM agents WHERE updated_at < ?", (time.time() - self.follow_up_ttl,))
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the size of the in-memory and persisted agent sets."""
+        persisted = self.conn.execute("SELECT COUNT(*) AS n FROM agents").fetchone()["n"]
+        return {
+            "in_memory": len(self._agents),
+            "in_memory_bytes": self._bytes,
+            "persisted_follow_ups": persisted,
+            "hits": self.hits,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
+
+    def _put(self, sender_id: Optional[str], agent: Agent):
+        self._bytes -= self._sizes.get(sender_id, 0)
+        size = _agent_size(agent)
+        self._agents[sender_id] = agent
+        self._agents.move_to_end(sender_id)
+        self._sizes[sender_id] = size
+        self._bytes += size
+
+    def _evict(self, sender_id: Optional[str]):
+        self._agents.pop(sender_id, None)
+        self._bytes -= self._sizes.pop(sender_id, 0)
+        self.evictions += 1
+
+    def _shrink(self):
+        while self._agents and (len(self._agents) > self.max_agents or self._bytes > self.max_bytes):
+            sender_id = next(iter(self._agents))
+            self._evict(sender_id)
+
+    def _load(self, sender_id: Optional[str]) -> Optional[Agent]:
+        row = self.conn.execute(
+            "SELECT * FROM agents WHERE sender_id = ? AND updated_at >= ?",
+            (sender_id or "", time.time() - self.follow_up_ttl),
+        ).fetchone()
+        if row is None:
+            return None
+
+        agent = Agent(sender_id)
+        agent.state = row["state"]
+        agent.history = json.loads(row["history"])
+        if row["original_report_message"]:
+            agent.original_report_message = NewMessageRequest.model_validate_json(row["original_report_message"])
+        return agent
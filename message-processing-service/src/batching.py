@@ -0,0 +1,104 @@
+import asyncio
+import contextvars
+import logging
+import traceback
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from src.accounting import batch_usage_labels, usage_labels
+from src.deadline import current_deadline
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Collects concurrent requests for up to window seconds and handles them in one call.
+
+    The first request of a batch starts the window; the batch is flushed
+    when the window closes or max_batch requests are waiting. process_batch
+    gets the items of a batch and returns one result per item, None where it
+    could not produce one; those items, and all items of a batch whose call
+    failed, are handled one by one by process_single instead.
+
+    A batch runs in a context of its own, not in the one of whichever caller
+    opened it: under the latest deadline among its callers, with its usage
+    shared among them. Single calls run in their caller's context.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        process_batch: Callable[[List[Any]], Awaitable[List[Optional[Any]]]],
+        process_single: Callable[[Any], Awaitable[Any]],
+        window: float = 0.3,
+        max_batch: int = 16,
+    ):
+        self.name = name
+        self.process_batch = process_batch
+        self.process_single = process_single
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: List[Tuple[Any, asyncio.Future, contextvars.Context]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def submit(self, item: Any) -> Any:
+        """
+        Returns the result for one item, once its batch has been handled.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future, contextvars.copy_context()))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush, context=contextvars.Context())
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.create_task(self._run(batch), context=contextvars.Context())
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future, contextvars.Context]]):
+        # Callers cancelled in the meantime (e.g. at their deadline) are left out
+        batch = [(item, future, context) for item, future, context in batch if not future.done()]
+        if not batch:
+            return
+        metrics.observe("batch_size", len(batch), help="Items handled per batched call", batch=self.name)
+
+        results: List[Optional[Any]] = [None] * len(batch)
+        if len(batch) > 1:
+            # Callers enforce their own deadlines; the call only has to end once none of them waits any more
+            deadlines = [context.get(current_deadline) for _, _, context in batch]
+            current_deadline.set(None if None in deadlines else max(deadlines))
+            batch_usage_labels.set([context.get(usage_labels) for _, _, context in batch])
+            try:
+                results = await self.process_batch([item for item, _, _ in batch])
+                if len(results) != len(batch):
+                    raise ValueError(f"Expected {len(batch)} results, got {len(results)}")
+            except Exception:
+                logger.error(f"Batched {self.name} call failed, falling back to single calls: {traceback.format_exc()}")
+                results = [None] * len(batch)
+
+        fallback = [(item, future, context) for (item, future, context), result in zip(batch, results) if result is None]
+        for (item, future, _), result in zip(batch, results):
+            if result is not None and not future.done():
+                future.set_result(result)
+        if fallback and len(batch) > 1:
+            metrics.inc("batch_fallbacks_total", len(fallback), help="Batched items handled by single calls instead", batch=self.name)
+        await asyncio.gather(*(
+            asyncio.create_task(self._run_single(item, future), context=context) for item, future, context in fallback
+        ))
+
+    async def _run_single(self, item: Any, future: asyncio.Future):
+        try:
+            result = await self.process_single(item)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
@@ -1,49 +1,77 @@
 import os
+import logging
 import aiohttp
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+
+from src.deadline import call_timeout
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
 
 # Default API URL
-BERT_API_URL = os.getenv("BERT_API_URL", "http://192.168.191.96:52004")
+BERT_API_URL = os.getenv("BERT_API_URL", os.getenv("CLASSIFICATION_SERVICE_URL", "http://192.168.191.96:52004"))
+# "cascade": confident BERT answers decide, only the uncertain band goes to the LLM;
+# "shadow": the LLM decides, BERT runs alongside and its agreement is logged; "off": BERT is not called
+BERT_MODE = os.getenv("BERT_MODE", "off").lower()
+# Report probabilities at or above BERT_REPORT_THRESHOLD are reports, at or below BERT_TALK_THRESHOLD chatter
+BERT_REPORT_THRESHOLD = float(os.getenv("BERT_REPORT_THRESHOLD", 0.9))
+BERT_TALK_THRESHOLD = float(os.getenv("BERT_TALK_THRESHOLD", 0.1))
 
 async def classify_text(message: str) -> Dict[str, float]:
     """
     Classifies text using the BERT classification service.
-    
+
     Args:
         message (str): The message to classify
-        
+
     Returns:
         dict: Dictionary containing classification probabilities
+
+    Raises:
+        aiohttp.ClientError: If the classification service could not be reached
+        RuntimeError: If the classification service answered with an error
     """
     url = f"{BERT_API_URL}/classify"
     payload = {"text": message}
-    
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.post(url, json=payload) as response:
-                if response.status == 200:
-                    return await response.json()
-                else:
-                    error_text = await response.text()
-                    return {"report": 0.0, "non-report": 1.0}
-        except Exception as e:
-            print(f"Error connecting to BERT classification service: {e}")
-            return {"report": 0.0, "non-report": 1.0}
-
-async def is_report_bert(message: str) -> bool:
-    """
-    Determines if a message is an agricultural report using BERT classification.
-    
-    Args:
-        message (str): The message to classify
-        
-    Returns:
-        bool: True if the message is classified as a report, False otherwise
-    """
-    result = await classify_text(message)
-    
-    print(f"Probability of report: {result.get('report', 0.0)}")
-    print(f"Probability of non-report: {result.get('non-report', 1.0)}")
-    
-    # Consider it a report if the report probability is higher than non-report
-    return result.get("report", 1.0) > result.get("non-report", 0.0)
\ No newline at end of file
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=call_timeout(30))) as session:
+        async with session.post(url, json=payload) as response:
+            if response.status == 200:
+                return await response.json()
+            error_text = await response.text()
+            raise RuntimeError(f"Classification service answered {response.status}: {error_text}")
+
+async def report_probability(message: str) -> Optional[float]:
+    """
+    Returns the probability that a message is a report, or None if the classification service failed.
+    """
+    try:
+        result = await classify_text(message)
+        return float(result["report"])
+    except Exception as e:
+        logger.error(f"Error classifying message with BERT: {e!r}")
+        metrics.inc("bert_errors_total", help="Failed calls to the classification service")
+        return None
+
+def decide(probability: Optional[float]) -> Optional[bool]:
+    """
+    Returns True or False for a confident report probability, None for the uncertain band or a failed call.
+    """
+    if probability is None:
+        return None
+    if probability >= BERT_REPORT_THRESHOLD:
+        return True
+    if probability <= BERT_TALK_THRESHOLD:
+        return False
+    return None
+
+def record_agreement(message: str, probability: float, llm_result: bool):
+    """
+    Logs whether BERT agreed with the LLM, by confidence band, to tune the thresholds.
+    """
+    decision = decide(probability)
+    band = "uncertain" if decision is None else "report" if decision else "talk"
+    agree = (probability >= 0.5) == llm_result
+    metrics.inc("bert_llm_agreement_total", help="BERT answers compared with the LLM by confidence band", band=band, agree=str(agree).lower())
+    if not agree:
+        logger.info(f"BERT ({probability:.3f}) disagrees with the LLM ({'REPORT' if llm_result else 'TALK'}) on {message[:80]!r}")
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import aiohttp
+from dotenv import load_dotenv
+
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+DATA_SERVICE_URL = os.environ["DATA_SERVICE_URL"]
+CHAT_CACHE_TTL = float(os.getenv("CHAT_CACHE_TTL", 300))
+CHAT_CACHE_NEGATIVE_TTL = float(os.getenv("CHAT_CACHE_NEGATIVE_TTL", 30))
+
+
+class ChatMetadataCache:
+    """
+    Async TTL cache of chat documents from the Data Service (/api/chats/{chat_id}).
+
+    Chats that do not exist are cached too (negative caching) for a shorter
+    time. Concurrent misses for the same chat share one request, and all
+    requests go through one shared aiohttp session. Transport errors and
+    unexpected statuses are not cached and are raised to the caller.
+    """
+
+    def __init__(self, base_url: str, ttl: float = 300.0, negative_ttl: float = 30.0):
+        self.base_url = base_url
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: Dict[str, Tuple[float, Optional[Dict[str, Any]]]] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Bumped on invalidation, so a fetch started before it does not store stale data
+        self._generation = 0
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def get(self, chat_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the chat document, or None if the Data Service does not know the chat.
+
+        Raises:
+            aiohttp.ClientError: If the Data Service could not be reached
+            RuntimeError: If the Data Service answered with an unexpected status
+        """
+        entry = self._entries.get(chat_id)
+        if entry is not None and entry[0] > time.monotonic():
+            metrics.inc("chat_cache_requests_total", help="Chat metadata lookups", result="hit")
+            return entry[1]
+
+        inflight = self._inflight.get(chat_id)
+        if inflight is not None:
+            metrics.inc("chat_cache_requests_total", result="shared")
+            return await asyncio.shield(inflight)
+
+        metrics.inc("chat_cache_requests_total", result="miss")
+        # The fetch runs as its own task, so cancelling the caller that started it does not cancel the other waiters
+        task = asyncio.create_task(self._fetch(chat_id))
+        self._inflight[chat_id] = task
+        task.add_done_callback(lambda done: self._forget(chat_id, done))
+        return await asyncio.shield(task)
+
+    def _forget(self, chat_id: str, task: asyncio.Task):
+        self._inflight.pop(chat_id, None)
+        # Mark the exception as retrieved in case nobody was waiting any more
+        if not task.cancelled():
+            task.exception()
+
+    async def _fetch(self, chat_id: str) -> Optional[Dict[str, Any]]:
+        url = f"{self.base_url}/api/chats/{chat_id}"
+        generation = self._generation
+        async with self._get_session().get(url) as response:
+            if response.status == 200:
+                chat = await response.json()
+                if generation == self._generation:
+                    self._entries[chat_id] = (time.monotonic() + self.ttl, chat)
+                return chat
+            if response.status == 404:
+                if generation == self._generation:
+                    self._entries[chat_id] = (time.monotonic() + self.negative_ttl, None)
+                return None
+            error_text = await response.text()
+            raise RuntimeError(f"Failed to fetch chat {chat_id}: {response.status} - {error_text}")
+
+    def invalidate(self, chat_id: Optional[str] = None):
+        """
+        Drops one chat from the cache, or all chats if chat_id is None.
+        """
+        self._generation += 1
+        if chat_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(chat_id, None)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+chat_cache = ChatMetadataCache(DATA_SERVICE_URL, ttl=CHAT_CACHE_TTL, negative_ttl=CHAT_CACHE_NEGATIVE_TTL)
@@ -0,0 +1,27 @@
+import os
+import sqlite3
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """
+    Opens a SQLite database used for the service's local state.
+
+    The parent directory is created if needed and the connection is switched
+    to WAL mode, so readers never block the writer and commits stay cheap.
+
+    Args:
+        path: Path to the database file
+
+    Returns:
+        An open sqlite3 connection in autocommit mode with rows as sqlite3.Row
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
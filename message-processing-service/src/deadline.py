@@ -0,0 +1,60 @@
+import asyncio
+import contextlib
+import contextvars
+import time
+from typing import Optional
+
+# Monotonic time by which the current message has to be processed, None if unbounded
+current_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("current_deadline", default=None)
+
+
+def remaining() -> Optional[float]:
+    """
+    Returns the seconds left of the current deadline, or None if there is none.
+    """
+    deadline = current_deadline.get()
+    return None if deadline is None else max(deadline - time.monotonic(), 0.0)
+
+
+def call_timeout(default: Optional[float] = None, grace: float = 1.0) -> Optional[float]:
+    """
+    Returns the timeout for an outbound call made under the current deadline.
+
+    The call gets the remaining budget plus a little grace, so the deadline
+    itself, not the call's own timeout, is what interrupts the pipeline; the
+    timeout only frees calls that outlive the task awaiting them (e.g. a
+    shared in-flight LLM request).
+
+    Args:
+        default: Timeout to use without a deadline, and upper bound with one
+        grace: Seconds added to the remaining budget
+    """
+    left = remaining()
+    if left is None:
+        return default
+    return left + grace if default is None else min(left + grace, default)
+
+
+@contextlib.asynccontextmanager
+async def deadline(seconds: Optional[float]):
+    """
+    Runs the enclosed block under a deadline of seconds from now.
+
+    Work still running when the deadline passes is cancelled at its next
+    await, and the block raises TimeoutError. A nested deadline can only
+    shorten the enclosing one. None or 0 leaves the block unbounded.
+    """
+    if not seconds:
+        yield
+        return
+
+    at = time.monotonic() + seconds
+    outer = current_deadline.get()
+    if outer is not None:
+        at = min(at, outer)
+    token = current_deadline.set(at)
+    try:
+        async with asyncio.timeout(at - time.monotonic()):
+            yield
+    finally:
+        current_deadline.reset(token)
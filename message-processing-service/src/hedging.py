@@ -0,0 +1,65 @@
+import math
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from src.metrics import metrics
+
+
+class HedgePolicy:
+    """
+    Decides when a slow LLM call gets a duplicate on another backend.
+
+    Latencies of recent successful calls are kept per stage, and a call is
+    hedged once it has run longer than the given percentile of them. Hedges
+    are paid from a budget that grows by budget per call, so at most about
+    that share of calls is sent twice, with bursts of up to max_burst hedges.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95.0,
+        budget: float = 0.05,
+        min_samples: int = 20,
+        window: int = 500,
+        min_delay: float = 1.0,
+        max_burst: float = 10.0,
+    ):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.window = window
+        self.min_delay = min_delay
+        self.max_burst = max_burst
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._tokens = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget > 0
+
+    def observe(self, stage: str, latency: float):
+        """Records the latency of a successful call."""
+        self._latencies.setdefault(stage, deque(maxlen=self.window)).append(latency)
+
+    def delay(self, stage: str) -> Optional[float]:
+        """
+        Returns after how many seconds a call of the stage should be hedged,
+        or None if hedging is off or there are not enough samples yet.
+        """
+        if not self.enabled:
+            return None
+        self._tokens = min(self.max_burst, self._tokens + self.budget)
+        latencies = self._latencies.get(stage)
+        if latencies is None or len(latencies) < self.min_samples:
+            return None
+        ordered = sorted(latencies)
+        index = min(len(ordered) - 1, math.ceil(self.percentile / 100 * len(ordered)) - 1)
+        return max(self.min_delay, ordered[index])
+
+    def allow(self) -> bool:
+        """Spends one hedge from the budget, if there is one left."""
+        if self._tokens < 1:
+            metrics.inc("llm_hedges_skipped_total", help="Slow LLM calls not hedged because the budget was spent")
+            return False
+        self._tokens -= 1
+        return True
@@ -0,0 +1,129 @@
+import hashlib
+import logging
+import math
+import time
+from typing import Optional
+
+from src.db import connect
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS seen_messages (
+    source_name TEXT NOT NULL,
+    chat_id TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    first_seen REAL NOT NULL,
+    PRIMARY KEY (source_name, chat_id, message_id)
+);
+CREATE INDEX IF NOT EXISTS seen_messages_first_seen ON seen_messages (first_seen);
+"""
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings.
+
+    Answers "definitely not seen" without touching the database; a positive
+    answer may be a false positive at roughly error_rate once capacity keys
+    have been added.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+def _message_key(source_name: str, chat_id: str, message_id: str) -> str:
+    return f"{source_name}\x1f{chat_id}\x1f{message_id}"
+
+
+class IdempotencyStore:
+    """
+    Remembers which messages were already accepted and with which status.
+
+    Lookups go through a Bloom filter first, so new messages - the common
+    case - never hit SQLite. Entries are kept for the retention window; the
+    filter is rebuilt from the table on start and after every purge, since
+    keys cannot be removed from it.
+    """
+
+    def __init__(self, path: str, retention: float = 72 * 3600, capacity: int = 1_000_000, error_rate: float = 0.001):
+        self.retention = retention
+        self.capacity = capacity
+        self.error_rate = error_rate
+
+        self.conn = connect(path)
+        self.conn.executescript(SCHEMA)
+        self.purge()
+
+    def _rebuild(self):
+        bloom = BloomFilter(self.capacity, self.error_rate)
+        for row in self.conn.execute("SELECT source_name, chat_id, message_id FROM seen_messages"):
+            bloom.add(_message_key(row["source_name"], row["chat_id"], row["message_id"]))
+        self.bloom = bloom
+
+    def get(self, source_name: str, chat_id: str, message_id: str) -> Optional[str]:
+        """
+        Returns the status a message was first answered with, or None if it is new.
+        """
+        if _message_key(source_name, chat_id, message_id) not in self.bloom:
+            return None
+
+        row = self.conn.execute(
+            "SELECT status FROM seen_messages WHERE source_name = ? AND chat_id = ? AND message_id = ? AND first_seen >= ?",
+            (source_name, chat_id, message_id, time.time() - self.retention),
+        ).fetchone()
+        if row is None:
+            metrics.inc("idempotency_bloom_false_positives_total", help="Bloom filter hits not confirmed by the database")
+            return None
+        return row["status"]
+
+    def record(self, source_name: str, chat_id: str, message_id: str, status: str):
+        """
+        Stores the status a message was answered with.
+        """
+        self.conn.execute(
+            """
+            INSERT INTO seen_messages (source_name, chat_id, message_id, status, first_seen) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (source_name, chat_id, message_id) DO UPDATE SET status = excluded.status
+            """,
+            (source_name, chat_id, message_id, status, time.time()),
+        )
+        self.bloom.add(_message_key(source_name, chat_id, message_id))
+
+    def forget(self, source_name: str, chat_id: str, message_id: str):
+        """
+        Removes a message, so a redelivery is processed as new.
+        """
+        self.conn.execute(
+            "DELETE FROM seen_messages WHERE source_name = ? AND chat_id = ? AND message_id = ?",
+            (source_name, chat_id, message_id),
+        )
+
+    def purge(self):
+        """
+        Forgets messages older than the retention window and rebuilds the filter.
+        """
+        deleted = self.conn.execute(
+            "DELETE FROM seen_messages WHERE first_seen < ?", (time.time() - self.retention,)
+        ).rowcount
+        self._rebuild()
+        if deleted:
+            logger.info(f"Purged {deleted} messages from the idempotency store")
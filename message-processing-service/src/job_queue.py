@@ -0,0 +1,534 @@
+import asyncio
+import contextvars
+import json
+import logging
+import sqlite3
+import time
+import traceback
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from src.db import connect
+from src.deadline import deadline
+from src.metrics import metrics
+from src.scheduler import BULK, WeightedFairScheduler
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_id TEXT,
+    lane TEXT,
+    chat_id TEXT,
+    job_class TEXT,
+    coalesce_key TEXT,
+    payload TEXT NOT NULL,
+    checkpoint TEXT,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    lease_expires_at REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    last_error TEXT
+);
+"""
+
+# Columns added after the first release, created on databases that predate them
+MIGRATIONS = {
+    "lane": "ALTER TABLE jobs ADD COLUMN lane TEXT",
+    "chat_id": "ALTER TABLE jobs ADD COLUMN chat_id TEXT",
+    "job_class": "ALTER TABLE jobs ADD COLUMN job_class TEXT",
+    "coalesce_key": "ALTER TABLE jobs ADD COLUMN coalesce_key TEXT",
+    "checkpoint": "ALTER TABLE jobs ADD COLUMN checkpoint TEXT",
+}
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS jobs_status_available ON jobs (status, available_at);
+CREATE INDEX IF NOT EXISTS jobs_lane_status ON jobs (lane, status);
+CREATE INDEX IF NOT EXISTS jobs_chat_status ON jobs (chat_id, status);
+CREATE INDEX IF NOT EXISTS jobs_coalesce_key ON jobs (coalesce_key, status);
+CREATE INDEX IF NOT EXISTS jobs_started_at ON jobs (started_at);
+CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at);
+"""
+
+# Eligible jobs are the heads of their lanes (no older job of the same lane is
+# queued or running); of those, the oldest one per class and chat is returned
+# for the scheduler to choose from.
+CANDIDATES = """
+SELECT * FROM (
+    SELECT j.*, ROW_NUMBER() OVER (PARTITION BY j.job_class, j.chat_id ORDER BY j.id) AS position
+    FROM jobs AS j
+    WHERE ((j.status = 'queued' AND j.available_at <= ?)
+           OR (j.status = 'running' AND j.lease_expires_at <= ?))
+      AND NOT EXISTS (
+          SELECT 1 FROM jobs AS o
+          WHERE o.lane = j.lane AND o.id < j.id AND o.status IN ('queued', 'running')
+      )
+)
+WHERE position = 1
+"""
+
+
+
+class JobContext:
+    """
+    Checkpoint of the job a worker is currently running.
+
+    Values saved here are written to the job row right away, so a job that
+    is interrupted (shutdown, crash, retry) resumes with them instead of
+    redoing the finished stages.
+    """
+
+    def __init__(self, queue: "JobQueue", job_id: int, checkpoint: Optional[str]):
+        self.queue = queue
+        self.job_id = job_id
+        self.values: Dict[str, Any] = json.loads(checkpoint) if checkpoint else {}
+
+    def save(self, key: str, value: Any):
+        self.values[key] = value
+        self.queue.conn.execute(
+            "UPDATE jobs SET checkpoint = ? WHERE id = ?",
+            (json.dumps(self.values, ensure_ascii=False), self.job_id),
+        )
+
+
+current_job: contextvars.ContextVar[Optional[JobContext]] = contextvars.ContextVar("current_job", default=None)
+
+
+def has_checkpoint(key: str) -> bool:
+    """
+    Returns whether a pipeline stage of the current job has already been checkpointed.
+    """
+    job = current_job.get()
+    return job is not None and key in job.values
+
+
+async def checkpointed(key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Returns the checkpointed value of a pipeline stage of the current job,
+    computing and checkpointing it if the stage has not finished before.
+    Outside of a job the value is simply computed. Values must be JSON-serializable.
+    """
+    job = current_job.get()
+    if job is not None and key in job.values:
+        logger.info(f"Job {job.job_id} resumes from checkpoint '{key}'")
+        return job.values[key]
+
+    value = await compute()
+    if job is not None:
+        job.save(key, value)
+    return value
+
+
+class JobQueue:
+    """
+    Durable job queue backed by SQLite with an asyncio worker pool.
+
+    Jobs are claimed with a lease (visibility timeout). A worker keeps extending
+    the lease while its handler runs; if the process dies, the lease expires and
+    the job becomes visible to workers again. Failed jobs are retried with
+    exponential backoff until max_attempts is reached, then marked as failed.
+
+    Every job belongs to a lane (e.g. a sender id). Jobs in the same lane run
+    strictly one at a time in enqueue order, while different lanes run in
+    parallel across the worker pool - each lane behaves like an actor mailbox.
+    A job waiting for a retry keeps its lane blocked, so later jobs never
+    overtake it.
+
+    Which eligible job starts next is decided by the scheduler, which puts
+    interactive jobs ahead of bulk ones and shares workers fairly between chats.
+
+    Every attempt of a job runs under a deadline of job_deadline seconds;
+    when it passes, the handler is cancelled and the attempt fails like any
+    other error, i.e. it is retried from its checkpoint or marked as failed.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        handler: Callable[[Dict[str, Any]], Awaitable[None]],
+        workers: int = 5,
+        visibility_timeout: float = 300.0,
+        max_attempts: int = 5,
+        backoff_base: float = 5.0,
+        backoff_max: float = 300.0,
+        poll_interval: float = 1.0,
+        retention: float = 24 * 3600,
+        scheduler: Optional[WeightedFairScheduler] = None,
+        job_deadline: Optional[float] = None,
+    ):
+        self.path = path
+        self.handler = handler
+        self.workers = workers
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.scheduler = scheduler or WeightedFairScheduler(workers)
+        self.job_deadline = job_deadline
+
+        self.conn = connect(path)
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+        self.conn.executescript(INDEXES)
+
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._active: Dict[int, asyncio.Task] = {}
+        self._running = False
+        self.draining = False
+
+    def _migrate(self):
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(jobs)")}
+        for column, statement in MIGRATIONS.items():
+            if column not in columns:
+                logger.info(f"Adding column '{column}' to job queue database")
+                self.conn.execute(statement)
+
+    # --- Producer side ---
+
+    def enqueue(
+        self,
+        payload: Dict[str, Any],
+        message_id: Optional[str] = None,
+        lane: str = "",
+        chat_id: Optional[str] = None,
+        job_class: str = BULK,
+        delay: float = 0.0,
+        coalesce_key: Optional[str] = None,
+    ) -> int:
+        """
+        Persists a job and wakes up an idle worker.
+
+        Args:
+            payload: JSON-serializable job payload passed to the handler
+            message_id: Optional message id, stored for diagnostics
+            lane: Ordering key; jobs with the same lane never run concurrently
+            chat_id: Chat the job belongs to, used for per-chat admission limits and fair sharing
+            job_class: Scheduling class, "interactive" or "bulk"
+            delay: Seconds before the job becomes visible to workers
+            coalesce_key: Key under which later jobs may be merged into this one (see enqueue_coalesced)
+
+        Returns:
+            The id of the new job
+        """
+        now = time.time()
+        cursor = self.conn.execute(
+            """
+            INSERT INTO jobs (message_id, lane, chat_id, job_class, coalesce_key, payload, available_at, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (message_id, lane, chat_id, job_class, coalesce_key, json.dumps(payload, ensure_ascii=False), now + delay, now),
+        )
+        self._wakeup.set()
+        return cursor.lastrowid
+
+    def enqueue_coalesced(
+        self,
+        payload: Dict[str, Any],
+        coalesce_key: str,
+        merge: Callable[[Dict[str, Any], Dict[str, Any]], Optional[Dict[str, Any]]],
+        window: float,
+        max_window: float,
+        **kwargs,
+    ) -> int:
+        """
+        Debounces jobs sharing a coalesce key into one.
+
+        The first job waits window seconds before it becomes visible. A job
+        with the same key arriving meanwhile is merged into the waiting one
+        and pushes its start back by another window, but never beyond
+        max_window seconds after the first job arrived. Jobs a worker has
+        already picked up are never modified.
+
+        Args:
+            payload: JSON-serializable job payload
+            coalesce_key: Jobs with equal keys are merged
+            merge: Combines the waiting payload with the new one, or returns None to queue the new one on its own
+            window: Debounce window in seconds
+            max_window: Upper bound on the total delay of a merged job
+            **kwargs: Passed to enqueue when no waiting job exists
+
+        Returns:
+            The id of the job the payload ended up in
+        """
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute(
+                """
+                SELECT id, payload, created_at FROM jobs
+                WHERE coalesce_key = ? AND status = 'queued' AND attempts = 0 AND created_at >= ?
+                ORDER BY id DESC
+                LIMIT 1
+                """,
+                (coalesce_key, now - max_window),
+            ).fetchone()
+            merged = merge(json.loads(row["payload"]), payload) if row is not None else None
+            if merged is not None:
+                self.conn.execute(
+                    "UPDATE jobs SET payload = ?, available_at = ? WHERE id = ?",
+                    (
+                        json.dumps(merged, ensure_ascii=False),
+                        min(now + window, row["created_at"] + max_window),
+                        row["id"],
+                    ),
+                )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        if merged is not None:
+            logger.info(f"Merged message {kwargs.get('message_id')} into job {row['id']}")
+            return row["id"]
+        return self.enqueue(payload, delay=window, coalesce_key=coalesce_key, **kwargs)
+
+    def depth(self) -> Dict[str, Any]:
+        """
+        Returns job counts by status, the number of lanes with pending work
+        and the age of the oldest queued job.
+        """
+        now = time.time()
+        counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+        for row in self.conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"):
+            counts[row["status"]] = row["n"]
+
+        lanes = self.conn.execute(
+            "SELECT COUNT(DISTINCT lane) AS n FROM jobs WHERE status IN ('queued', 'running')"
+        ).fetchone()["n"]
+
+        oldest = self.conn.execute(
+            "SELECT MIN(created_at) AS created_at FROM jobs WHERE status = 'queued'"
+        ).fetchone()["created_at"]
+
+        return {
+            **counts,
+            "workers": self.workers,
+            "active_lanes": lanes,
+            "oldest_queued_age": round(now - oldest, 3) if oldest else 0.0,
+        }
+
+    def pending(self, chat_id: Optional[str] = None) -> int:
+        """
+        Returns the number of queued and running jobs, optionally for one chat only.
+        """
+        if chat_id is None:
+            query, params = "SELECT COUNT(*) AS n FROM jobs WHERE status IN ('queued', 'running')", ()
+        else:
+            query = "SELECT COUNT(*) AS n FROM jobs WHERE chat_id = ? AND status IN ('queued', 'running')"
+            params = (chat_id,)
+        return self.conn.execute(query, params).fetchone()["n"]
+
+    def wait_stats(self, window: float = 300.0) -> Dict[str, float]:
+        """
+        Returns the average queue wait of jobs started within the last window
+        seconds and the drain rate (finished jobs per second) over that window.
+        """
+        since = time.time() - window
+        wait = self.conn.execute(
+            "SELECT AVG(started_at - created_at) AS wait FROM jobs WHERE started_at >= ?",
+            (since,),
+        ).fetchone()["wait"]
+        finished = self.conn.execute(
+            "SELECT COUNT(*) AS n FROM jobs WHERE status IN ('done', 'failed') AND finished_at >= ?",
+            (since,),
+        ).fetchone()["n"]
+        return {"avg_wait": round(wait or 0.0, 3), "drain_rate": round(finished / window, 3)}
+
+    def retry_after(self, backlog: int, minimum: int = 1, maximum: int = 300, default: int = 30) -> int:
+        """
+        Estimates how many seconds it takes to drain backlog jobs at the
+        recent drain rate, for Retry-After headers. Falls back to default
+        while nothing has finished recently.
+        """
+        drain_rate = self.wait_stats()["drain_rate"]
+        if drain_rate <= 0:
+            return default
+        return int(min(max(backlog / drain_rate, minimum), maximum))
+
+    # --- Worker side ---
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            candidates = self.conn.execute(CANDIDATES, (now, now)).fetchall()
+            row = self.scheduler.pick(candidates) if candidates else None
+            if row is not None:
+                if row["status"] == "running":
+                    logger.warning(f"Lease expired for job {row['id']} (message {row['message_id']}), reclaiming")
+                self.conn.execute(
+                    """
+                    UPDATE jobs
+                    SET status = 'running', attempts = attempts + 1, started_at = ?, lease_expires_at = ?
+                    WHERE id = ?
+                    """,
+                    (now, now + self.visibility_timeout, row["id"]),
+                )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        if row is not None:
+            self.scheduler.started(row)
+        return row
+
+    def _complete(self, job_id: int):
+        self.conn.execute(
+            "UPDATE jobs SET status = 'done', finished_at = ?, lease_expires_at = NULL WHERE id = ?",
+            (time.time(), job_id),
+        )
+
+    def _fail(self, job_id: int, attempts: int, error: str):
+        now = time.time()
+        if attempts >= self.max_attempts:
+            logger.error(f"Job {job_id} failed after {attempts} attempts, giving up")
+            self.conn.execute(
+                "UPDATE jobs SET status = 'failed', finished_at = ?, lease_expires_at = NULL, last_error = ? WHERE id = ?",
+                (now, error, job_id),
+            )
+            return
+
+        delay = min(self.backoff_base * 2 ** (attempts - 1), self.backoff_max)
+        logger.warning(f"Job {job_id} failed (attempt {attempts}/{self.max_attempts}), retrying in {delay:.0f}s")
+        self.conn.execute(
+            "UPDATE jobs SET status = 'queued', available_at = ?, lease_expires_at = NULL, last_error = ? WHERE id = ?",
+            (now + delay, error, job_id),
+        )
+
+    def _release(self, job_id: int):
+        # An interrupted attempt does not count against max_attempts
+        self.conn.execute(
+            """
+            UPDATE jobs SET status = 'queued', available_at = ?, lease_expires_at = NULL, attempts = MAX(attempts - 1, 0)
+            WHERE id = ? AND status = 'running'
+            """,
+            (time.time(), job_id),
+        )
+
+    def _purge(self):
+        self.conn.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+            (time.time() - self.retention,),
+        )
+
+    async def _keep_lease(self, job_id: int):
+        while True:
+            await asyncio.sleep(self.visibility_timeout / 3)
+            self.conn.execute(
+                "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND status = 'running'",
+                (time.time() + self.visibility_timeout, job_id),
+            )
+
+    async def _run_job(self, row):
+        job_id = row["id"]
+        attempts = row["attempts"] + 1
+        heartbeat = asyncio.create_task(self._keep_lease(job_id))
+        current_job.set(JobContext(self, job_id, row["checkpoint"]))
+        started_at = time.monotonic()
+        try:
+            async with deadline(self.job_deadline):
+                await self.handler(json.loads(row["payload"]))
+        except asyncio.CancelledError:
+            if not asyncio.current_task().cancelling():
+                # Raised by the handler itself, not a cancellation of this job: an ordinary failure
+                logger.error(f"Error processing job {job_id}: {traceback.format_exc()}")
+                self._fail(job_id, attempts, traceback.format_exc(limit=5))
+                return
+            logger.warning(f"Job {job_id} interrupted, returning it to the queue with its checkpoint")
+            self._release(job_id)
+            raise
+        except TimeoutError:
+            if not self.job_deadline or time.monotonic() - started_at < self.job_deadline:
+                # A timeout of the handler itself, not the deadline
+                logger.error(f"Error processing job {job_id}: {traceback.format_exc()}")
+                self._fail(job_id, attempts, traceback.format_exc(limit=5))
+            else:
+                metrics.inc("job_deadline_exceeded_total", help="Job attempts cancelled at their deadline")
+                logger.error(f"Job {job_id} exceeded its {self.job_deadline:g}s deadline, cancelled (attempt {attempts})")
+                self._fail(job_id, attempts, f"Deadline of {self.job_deadline:g}s exceeded")
+        except Exception:
+            logger.error(f"Error processing job {job_id}: {traceback.format_exc()}")
+            self._fail(job_id, attempts, traceback.format_exc(limit=5))
+        else:
+            self._complete(job_id)
+        finally:
+            heartbeat.cancel()
+            self.scheduler.finished(row)
+            # The next job of this lane may be eligible now
+            self._wakeup.set()
+
+    async def _worker(self, index: int):
+        while self._running:
+            row = self._claim()
+            if row is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Another job may be waiting; let an idle worker have a look
+            self._wakeup.set()
+            logger.info(f"Worker {index} picked job {row['id']} (message {row['message_id']}, lane {row['lane']!r}, attempt {row['attempts'] + 1})")
+            # Run as a separate task so drain() can wait for it while idle workers are stopped
+            task = asyncio.create_task(self._run_job(row))
+            self._active[row["id"]] = task
+            task.add_done_callback(lambda _, job_id=row["id"]: self._active.pop(job_id, None))
+            try:
+                await asyncio.shield(task)
+            except asyncio.CancelledError:
+                # Only a stop of the pool ends the worker, not a cancelled job
+                if not self._running or asyncio.current_task().cancelling():
+                    raise
+
+    async def _janitor(self):
+        while self._running:
+            try:
+                self._purge()
+            except Exception:
+                logger.error(f"Error purging finished jobs: {traceback.format_exc()}")
+            await asyncio.sleep(3600)
+
+    async def start(self):
+        """Starts the worker pool."""
+        self._running = True
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._janitor()))
+        logger.info(f"Job queue started with {self.workers} workers ({self.depth()['queued']} jobs queued)")
+
+    async def drain(self, timeout: float):
+        """
+        Stops claiming jobs and waits up to timeout seconds for running jobs.
+        Jobs still running after that are cancelled and put back in the queue
+        with their checkpoints, ready for the next start.
+        """
+        self.draining = True
+        self._running = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        active = list(self._active.values())
+        if not active:
+            return
+
+        logger.info(f"Waiting up to {timeout:.0f}s for {len(active)} running jobs")
+        done, pending = await asyncio.wait(active, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        logger.info(f"Drained job queue: {len(done)} jobs finished, {len(pending)} checkpointed for restart")
+
+    async def stop(self, drain_timeout: float = 0.0):
+        """Drains the worker pool and closes the database."""
+        await self.drain(drain_timeout)
+        self.conn.close()
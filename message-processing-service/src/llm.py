@@ -1,21 +1,79 @@
 import os
-from openai import AsyncOpenAI
-from typing import List, Dict, Any, Optional
+import asyncio
+import contextvars
+import logging
+import random
+import traceback
+import time
+import openai
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+from typing import Callable, List, Dict, Any, Optional, Tuple
+
+from src.llm_cache import cache_key, llm_cache
+from src.metrics import metrics
+from src.llm_limits import TokenBucket
+from src.llm_backends import Backend, LLMBalancer
+from src.hedging import HedgePolicy
+from src.accounting import usage
+from src.deadline import call_timeout, current_deadline, remaining
+
+logger = logging.getLogger(__name__)
 
 LLM_SERVICE_URL = os.environ["LLM_SERVICE_URL"]
+# OpenAI-compatible endpoints calls are balanced across (comma-separated); defaults to LLM_SERVICE_URL
+LLM_SERVICE_URLS = [url.strip() for url in os.getenv("LLM_SERVICE_URLS", LLM_SERVICE_URL).split(",") if url.strip()]
+# A backend failing LLM_EJECT_AFTER calls in a row is out of rotation for LLM_EJECT_SECONDS
+LLM_EJECT_AFTER = int(os.getenv("LLM_EJECT_AFTER", 3))
+LLM_EJECT_SECONDS = float(os.getenv("LLM_EJECT_SECONDS", 30))
+LLM_HEALTH_CHECK_INTERVAL = float(os.getenv("LLM_HEALTH_CHECK_INTERVAL", 15))
+# Adaptive concurrency per backend: the limit starts at LLM_CONCURRENCY, grows while calls finish within
+# LLM_LATENCY_TARGET seconds and halves on 429 / 5xx answers or slower calls
+LLM_CONCURRENCY = float(os.getenv("LLM_CONCURRENCY", 4))
+LLM_CONCURRENCY_MIN = float(os.getenv("LLM_CONCURRENCY_MIN", 1))
+LLM_CONCURRENCY_MAX = float(os.getenv("LLM_CONCURRENCY_MAX", 32))
+LLM_LATENCY_TARGET = float(os.getenv("LLM_LATENCY_TARGET", 30))
+# Per-model rate limits in calls per minute ("model:rpm,...")
+LLM_RATE_LIMITS = {
+    model.strip(): float(rpm)
+    for model, rpm in (item.rsplit(":", 1) for item in os.getenv("LLM_RATE_LIMITS", "").split(",") if item.strip())
+}
+# Retries of overloaded calls, honoring Retry-After or backing off exponentially from LLM_RETRY_BACKOFF seconds
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 4))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", 1))
 
-print("URI" + LLM_SERVICE_URL)
+# Hedging: a call running longer than the LLM_HEDGE_PERCENTILE of recent calls of its stage is duplicated
+# to another backend, for at most about LLM_HEDGE_BUDGET of all calls (0 disables hedging)
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", 95))
+LLM_HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", 0))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", 1))
+# Stream answers to measure time to first token; needs a backend supporting stream_options
+LLM_STREAMING = os.getenv("LLM_STREAMING", "false").lower() in ("1", "true", "yes")
 
-client = AsyncOpenAI(
-    base_url=LLM_SERVICE_URL,
-    api_key="nova-proxy"
+balancer = LLMBalancer(
+    LLM_SERVICE_URLS,
+    limit_options=dict(
+        initial=LLM_CONCURRENCY,
+        min_limit=LLM_CONCURRENCY_MIN,
+        max_limit=LLM_CONCURRENCY_MAX,
+        latency_target=LLM_LATENCY_TARGET,
+    ),
+    eject_after=LLM_EJECT_AFTER,
+    eject_seconds=LLM_EJECT_SECONDS,
 )
+hedging = HedgePolicy(percentile=LLM_HEDGE_PERCENTILE, budget=LLM_HEDGE_BUDGET, min_delay=LLM_HEDGE_MIN_DELAY)
+rate_limits = {model: TokenBucket(rpm / 60) for model, rpm in LLM_RATE_LIMITS.items()}
+
+_inflight: Dict[str, Tuple[asyncio.Task, contextvars.Context]] = {}
 
 async def chat(
     model: str,
     messages: List[Dict[str, Any]],
     tools: Optional[List[Dict[str, Any]]] = None,
-    structure: Optional[Any] = None
+    structure: Optional[Any] = None,
+    stage: Optional[str] = None,
+    prompt_version: Optional[str] = None,
+    cacheable: Optional[Callable[[str], bool]] = None
 ) -> Dict[str, Any]:
     """
     Asynchronously call the LLM API with the given parameters.
@@ -24,10 +82,69 @@ async def chat(
         model: The model name to use
         messages: Array of message objects with role and content
         tools: Optional list of tools for function calling capability
+        stage: Pipeline stage of the call; responses of stages with a cache TTL are reused
+        prompt_version: Version of the system prompt, part of the cache key
+        cacheable: Check an answer has to pass to be cached, e.g. that the stage can parse it
     
     Returns:
         The API response as a dictionary
     """
+    started_at = time.monotonic()
+    key = cache_key(model, messages, tools, structure, prompt_version)
+    if llm_cache.enabled(stage):
+        cached = llm_cache.get(key, stage)
+        if cached is not None:
+            response = ChatCompletion.model_validate_json(cached)
+            if _cacheable(response, cacheable):
+                usage.record(stage or "", model, "cache", time.monotonic() - started_at)
+                return response
+
+    # Identical concurrent calls share one upstream request
+    shared = _inflight.get(key)
+    if shared is not None:
+        task, context = shared
+        _extend_deadline(context)
+        metrics.inc("llm_singleflight_saved_calls_total", help="LLM calls answered by an identical in-flight call", stage=stage or "")
+        response = await asyncio.shield(task)
+        usage.record(stage or "", model, "shared", time.monotonic() - started_at)
+        return response
+
+    # The request serves every caller sharing it, each cancelled at its own deadline, so it runs in a
+    # context of its own under the latest of their deadlines rather than under the first caller's
+    context = contextvars.copy_context()
+    task = asyncio.create_task(_request(key, model, messages, tools, structure, stage, cacheable), context=context)
+    _inflight[key] = (task, context)
+    task.add_done_callback(lambda done: _forget(key, done))
+    return await asyncio.shield(task)
+
+
+def _extend_deadline(context: contextvars.Context):
+    """
+    Extends the deadline of a shared request to the current caller's, if that is later.
+    Calls and retries the request starts from then on get the extended budget.
+    """
+    deadline = current_deadline.get()
+    shared_deadline = context.get(current_deadline)
+    if shared_deadline is not None and (deadline is None or deadline > shared_deadline):
+        context.run(current_deadline.set, deadline)
+
+
+def _forget(key: str, task: asyncio.Task):
+    _inflight.pop(key, None)
+    # Retrieve the exception, in case every caller was cancelled before the call failed
+    if not task.cancelled():
+        task.exception()
+
+
+async def _request(
+    key: str,
+    model: str,
+    messages: List[Dict[str, Any]],
+    tools: Optional[List[Dict[str, Any]]],
+    structure: Optional[Any],
+    stage: Optional[str],
+    cacheable: Optional[Callable[[str], bool]]
+):
     kwargs = {
         "model": model,
         "messages": messages,
@@ -44,9 +161,175 @@ async def chat(
     
     extra_body["reasoning_options_mode"] = "ENABLED_HIDDEN"
     
+    started_at = time.monotonic()
+    bucket = rate_limits.get(model)
+    backend = None
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        if bucket is not None:
+            waited = await bucket.acquire()
+            if waited:
+                metrics.observe("llm_rate_limit_wait_seconds", waited, help="Time calls waited for the per-model rate limit", model=model)
+
+        # Retries go to another backend if there is one
+        backend = balancer.pick(exclude=backend)
+        try:
+            response, ttft = await _hedged(backend, kwargs, extra_body, stage or "", bucket)
+            break
+        except (openai.APIStatusError, openai.APIConnectionError) as e:
+            delay = _retry_delay(e, attempt)
+            left = remaining()
+            # No retry that could not finish before the message deadline
+            if not _is_overload(e) or attempt == LLM_MAX_RETRIES or (left is not None and delay >= left):
+                logger.error(f"Error calling LLM API {backend.url}: {e}")
+                raise
+            logger.warning(f"LLM API {backend.url} overloaded ({getattr(e, 'status_code', None) or e}), retrying in {delay:.1f}s")
+        except Exception:
+            logger.error(f"Error calling LLM API {backend.url}: {traceback.format_exc()}")
+            raise
+        await asyncio.sleep(delay)
+
+    usage.record(
+        stage or "",
+        model,
+        "llm",
+        time.monotonic() - started_at,
+        ttft,
+        response.usage.prompt_tokens if response.usage else 0,
+        response.usage.completion_tokens if response.usage else 0,
+    )
+
+    # An answer the stage cannot use would be served again to every retry of the message
+    if llm_cache.enabled(stage) and _cacheable(response, cacheable):
+        llm_cache.put(key, stage, response.model_dump_json())
+    return response
+
+
+def _cacheable(response: ChatCompletion, cacheable: Optional[Callable[[str], bool]]) -> bool:
+    content = response.choices[0].message.content if response.choices else None
+    if not content:
+        return False
     try:
-        response = await client.chat.completions.create(**kwargs, extra_body=extra_body)
-        return response
-    except Exception as e:
-        print(f"Error calling LLM API: {e}")
-        raise
\ No newline at end of file
+        return cacheable is None or cacheable(content)
+    except Exception:
+        return False
+
+
+async def _hedged(backend: Backend, kwargs: Dict[str, Any], extra_body: Dict[str, Any], stage: str, bucket: Optional[TokenBucket]):
+    """
+    Sends a call and, if it runs longer than the hedging delay of its stage,
+    a duplicate to another backend. The first successful answer wins and
+    the other call is cancelled.
+
+    Returns:
+        The response and its time to first token (None unless streamed)
+    """
+    # A duplicate on the same backend would only add to its load
+    delay = hedging.delay(stage) if len(balancer.backends) > 1 else None
+    if delay is None:
+        return await _call(backend, kwargs, extra_body, stage)
+
+    primary = asyncio.create_task(_call(backend, kwargs, extra_body, stage))
+    tasks = {primary}
+    hedge = None
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        other = balancer.alternative(backend) if not done else None
+        if other is not None and hedging.allow() and (bucket is None or bucket.try_acquire()):
+            metrics.inc("llm_hedged_requests_total", help="LLM calls duplicated to another backend after running long", stage=stage)
+            hedge = asyncio.create_task(_call(other, kwargs, extra_body, stage))
+            tasks.add(hedge)
+
+        while True:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                tasks.discard(task)
+                error = task.exception()
+                if error is None:
+                    if hedge is not None:
+                        metrics.inc("llm_hedge_wins_total", help="Hedged LLM calls by the call that answered first", stage=stage, winner="hedge" if task is hedge else "primary")
+                    return task.result()
+            if not tasks:
+                raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _call(backend: Backend, kwargs: Dict[str, Any], extra_body: Dict[str, Any], stage: str):
+    """
+    Sends one call to a backend, accounting it in the balancer and in the backend's concurrency limit.
+    """
+    balancer.started(backend)
+    latency = None
+    overloaded = False
+    try:
+        started_at = await backend.limit.acquire()
+        try:
+            metrics.inc("llm_requests_total", help="Calls sent to the LLM service", stage=stage)
+            # Bounded by the message deadline, so a call outliving its callers does not hold a slot
+            timeout = call_timeout()
+            options = {"timeout": timeout} if timeout is not None else {}
+            if LLM_STREAMING and "tools" not in kwargs:
+                response, ttft = await _stream(backend, kwargs, extra_body, started_at, options)
+            else:
+                response, ttft = await backend.client.chat.completions.create(**kwargs, extra_body=extra_body, **options), None
+            latency = time.monotonic() - started_at
+            hedging.observe(stage, latency)
+            return response, ttft
+        except (openai.APIStatusError, openai.APIConnectionError) as e:
+            overloaded = _is_overload(e)
+            if overloaded:
+                metrics.inc("llm_overload_responses_total", help="LLM calls answered with 429 / 5xx or failed to connect", status=getattr(e, "status_code", None) or "connection")
+            raise
+        finally:
+            await backend.limit.release(started_at, overloaded)
+    finally:
+        balancer.finished(backend, latency, overloaded)
+
+
+async def _stream(backend: Backend, kwargs: Dict[str, Any], extra_body: Dict[str, Any], started_at: float, options: Dict[str, Any]):
+    """
+    Streams an answer and assembles it into a regular ChatCompletion.
+
+    Returns:
+        The response and the seconds from started_at to its first content token
+    """
+    stream = await backend.client.chat.completions.create(
+        **kwargs, extra_body=extra_body, stream=True, stream_options={"include_usage": True}, **options
+    )
+    ttft = None
+    content = []
+    finish_reason = None
+    last = None
+    async for chunk in stream:
+        last = chunk
+        for choice in chunk.choices:
+            if choice.delta.content:
+                if ttft is None:
+                    ttft = time.monotonic() - started_at
+                content.append(choice.delta.content)
+            finish_reason = choice.finish_reason or finish_reason
+
+    response = ChatCompletion(
+        id=last.id if last else "",
+        object="chat.completion",
+        created=last.created if last else int(time.time()),
+        model=last.model if last else kwargs["model"],
+        choices=[Choice(index=0, finish_reason=finish_reason or "stop", message=ChatCompletionMessage(role="assistant", content="".join(content)))],
+        usage=last.usage if last else None,
+    )
+    return response, ttft
+
+
+def _is_overload(error: Exception) -> bool:
+    status = getattr(error, "status_code", None)
+    return status is None or status == 429 or status >= 500
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return LLM_RETRY_BACKOFF * 2 ** attempt * (0.5 + random.random())
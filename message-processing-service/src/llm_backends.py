@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import random
+import time
+import traceback
+from typing import List, Optional
+
+import openai
+from openai import AsyncOpenAI
+
+from src.llm_limits import AdaptiveConcurrencyLimit
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Backend:
+    """
+    One OpenAI-compatible endpoint with its own client and concurrency limit.
+    """
+
+    def __init__(self, url: str, limit: AdaptiveConcurrencyLimit, api_key: str = "nova-proxy"):
+        self.url = url
+        # Retries are done by the caller, so the limit and the balancer see every failure
+        self.client = AsyncOpenAI(base_url=url, api_key=api_key, max_retries=0)
+        self.limit = limit
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+
+    @property
+    def ejected(self) -> bool:
+        return self.ejected_until > time.monotonic()
+
+
+class LLMBalancer:
+    """
+    Routes LLM calls to the backend with the fewest outstanding requests.
+
+    A backend that fails eject_after calls in a row (429 / 5xx answers or
+    connection errors) is ejected for eject_seconds; the periodic health
+    check brings it back early once it answers again. When every backend is
+    ejected, the one coming back soonest is used rather than failing.
+    """
+
+    def __init__(self, urls: List[str], limit_options: dict, eject_after: int = 3, eject_seconds: float = 30.0):
+        self.backends = [Backend(url, AdaptiveConcurrencyLimit(name=url, **limit_options)) for url in urls]
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+
+    def pick(self, exclude: Optional[Backend] = None) -> Backend:
+        """
+        Returns the healthy backend with the fewest outstanding requests, avoiding exclude if possible.
+        """
+        candidates = [backend for backend in self.backends if backend is not exclude] or self.backends
+        healthy = [backend for backend in candidates if not backend.ejected]
+        if not healthy:
+            return min(candidates, key=lambda backend: backend.ejected_until)
+        fewest = min(backend.outstanding for backend in healthy)
+        return random.choice([backend for backend in healthy if backend.outstanding == fewest])
+
+    def alternative(self, backend: Backend) -> Optional[Backend]:
+        """
+        Returns the healthy backend other than backend with the fewest outstanding requests, or None if there is none.
+        """
+        healthy = [other for other in self.backends if other is not backend and not other.ejected]
+        if not healthy:
+            return None
+        fewest = min(other.outstanding for other in healthy)
+        return random.choice([other for other in healthy if other.outstanding == fewest])
+
+    def started(self, backend: Backend):
+        """Accounts a call routed to a backend, before it waits for the backend's concurrency limit."""
+        backend.outstanding += 1
+        self._report(backend)
+
+    def finished(self, backend: Backend, latency: Optional[float], failed: bool = False):
+        """
+        Accounts a finished call.
+
+        Args:
+            backend: The backend the call was routed to
+            latency: Seconds the backend took to answer, or None if the call did not complete
+            failed: Whether the backend was overloaded or unreachable
+        """
+        backend.outstanding -= 1
+        if failed:
+            backend.failures += 1
+            if backend.failures >= self.eject_after and not backend.ejected:
+                self._eject(backend)
+        elif latency is not None:
+            backend.failures = 0
+            metrics.observe("llm_backend_latency_seconds", latency, help="Latency of completed LLM calls by backend", backend=backend.url)
+        self._report(backend)
+
+    def _eject(self, backend: Backend):
+        backend.ejected_until = time.monotonic() + self.eject_seconds
+        metrics.inc("llm_backend_ejections_total", help="Backends taken out of rotation after repeated failures", backend=backend.url)
+        logger.warning(f"Ejected LLM backend {backend.url} for {self.eject_seconds:.0f}s after {backend.failures} failures")
+
+    def _report(self, backend: Backend):
+        metrics.set("llm_backend_outstanding_requests", backend.outstanding, help="LLM calls routed to a backend and not finished", backend=backend.url)
+        metrics.set("llm_backend_ejected", int(backend.ejected), help="Whether a backend is out of rotation", backend=backend.url)
+
+    async def check(self, backend: Backend, timeout: float = 5.0) -> bool:
+        """
+        Checks whether a backend answers; any answer below 500 counts as alive.
+        """
+        try:
+            await backend.client.with_options(timeout=timeout).models.list()
+            return True
+        except openai.APIStatusError as e:
+            return e.status_code < 500
+        except openai.APIError:
+            return False
+
+    async def check_periodically(self, interval: float):
+        """
+        Health-checks all backends every interval seconds: failing backends
+        are ejected, recovered ones are put back into rotation.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                results = await asyncio.gather(*(self.check(backend) for backend in self.backends))
+                for backend, alive in zip(self.backends, results):
+                    if alive:
+                        if backend.ejected:
+                            logger.info(f"LLM backend {backend.url} recovered")
+                        backend.failures = 0
+                        backend.ejected_until = 0.0
+                    elif not backend.ejected:
+                        backend.failures = max(backend.failures, self.eject_after)
+                        self._eject(backend)
+                    self._report(backend)
+            except Exception:
+                logger.error(f"Error checking LLM backends: {traceback.format_exc()}")
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from src.db import connect
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", "data/llm_cache.db")
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", 2000))
+# Seconds a response is reused per stage ("stage:ttl,..."); stages not listed are not cached
+LLM_CACHE_TTLS = {
+    stage.strip(): float(ttl)
+    for stage, ttl in (
+        item.rsplit(":", 1)
+        for item in os.getenv("LLM_CACHE_TTLS", "is_report:604800,split_report:604800,extract_csv:604800").split(",")
+        if item.strip()
+    )
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_responses (
+    key TEXT PRIMARY KEY,
+    stage TEXT NOT NULL,
+    response TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS llm_responses_expires_at ON llm_responses (expires_at);
+"""
+
+
+def cache_key(model: str, messages: Any, tools: Any = None, structure: Any = None, prompt_version: Optional[str] = None) -> str:
+    """
+    Returns the content address of an LLM request.
+    """
+    request = {
+        "model": model,
+        "messages": messages,
+        "tools": tools,
+        "structure": structure,
+        "prompt_version": prompt_version,
+    }
+    encoded = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Two-tier cache of serialized LLM responses by request content address.
+
+    Lookups go to an in-memory LRU first and to SQLite second; a SQLite hit
+    is promoted into memory. Every stage has its own TTL, and only stages
+    with a TTL are cached, so conversational calls are never reused.
+    """
+
+    def __init__(self, path: str, ttls: Dict[str, float], max_entries: int = 2000):
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+        self.conn = connect(path)
+        self.conn.executescript(SCHEMA)
+        self.purge()
+
+        metrics.collector(self._collect)
+
+    def enabled(self, stage: Optional[str]) -> bool:
+        return stage is not None and self.ttls.get(stage, 0) > 0
+
+    def get(self, key: str, stage: str) -> Optional[str]:
+        """
+        Returns the cached response for a request, or None on a miss.
+        """
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._memory.move_to_end(key)
+                metrics.inc("llm_cache_requests_total", help="LLM response cache lookups", stage=stage, result="memory")
+                return entry[1]
+            del self._memory[key]
+
+        row = self.conn.execute(
+            "SELECT response, expires_at FROM llm_responses WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        if row is not None:
+            self._remember(key, row["expires_at"], row["response"])
+            metrics.inc("llm_cache_requests_total", stage=stage, result="disk")
+            return row["response"]
+
+        metrics.inc("llm_cache_requests_total", stage=stage, result="miss")
+        return None
+
+    def put(self, key: str, stage: str, response: str):
+        """
+        Stores a response for the TTL of its stage.
+        """
+        now = time.time()
+        expires_at = now + self.ttls[stage]
+        self._remember(key, expires_at, response)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO llm_responses (key, stage, response, created_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+            (key, stage, response, now, expires_at),
+        )
+
+    def _remember(self, key: str, expires_at: float, response: str):
+        self._memory[key] = (expires_at, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def purge(self):
+        """
+        Deletes expired responses.
+        """
+        deleted = self.conn.execute("DELETE FROM llm_responses WHERE expires_at <= ?", (time.time(),)).rowcount
+        if deleted:
+            logger.info(f"Purged {deleted} expired LLM responses")
+
+    def _collect(self):
+        metrics.set("llm_cache_memory_entries", len(self._memory), help="LLM responses held in memory")
+        for stage in self.ttls:
+            hits = metrics.get("llm_cache_requests_total", stage=stage, result="memory") + metrics.get(
+                "llm_cache_requests_total", stage=stage, result="disk"
+            )
+            total = hits + metrics.get("llm_cache_requests_total", stage=stage, result="miss")
+            if total:
+                metrics.set("llm_cache_hit_ratio", hits / total, help="Share of LLM calls answered from the cache", stage=stage)
+
+
+llm_cache = LLMResponseCache(LLM_CACHE_DB, LLM_CACHE_TTLS, max_entries=LLM_CACHE_MEMORY_ENTRIES)
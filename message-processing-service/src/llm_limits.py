@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveConcurrencyLimit:
+    """
+    AIMD limit on the number of concurrent LLM calls.
+
+    Every call that finishes within latency_target without an overload
+    answer raises the limit by 1 / limit, i.e. by about one per round of
+    calls. A 429, a 5xx or a call slower than latency_target multiplies the
+    limit by backoff. Only calls started after the previous decrease can
+    trigger the next one, so one congestion episode shrinks the limit once
+    rather than once per call that was caught in it.
+    """
+
+    def __init__(
+        self,
+        name: str = "",
+        initial: float = 4,
+        min_limit: float = 1,
+        max_limit: float = 32,
+        latency_target: float = 30.0,
+        backoff: float = 0.5,
+    ):
+        self.name = name
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.inflight = 0
+        self._decreased_at = 0.0
+        self._changed = asyncio.Condition()
+
+    async def acquire(self) -> float:
+        """
+        Waits until a call may start and returns its start time for release().
+        """
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.inflight < int(self.limit))
+            self.inflight += 1
+        self._report()
+        return time.monotonic()
+
+    async def release(self, started_at: float, overloaded: bool = False):
+        """
+        Accounts a finished call and adapts the limit.
+
+        Args:
+            started_at: The value returned by acquire()
+            overloaded: Whether the backend answered with 429 / 5xx or could not be reached
+        """
+        latency = time.monotonic() - started_at
+        async with self._changed:
+            self.inflight -= 1
+            if overloaded or latency > self.latency_target:
+                if started_at >= self._decreased_at and self.limit > self.min_limit:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._decreased_at = time.monotonic()
+                    logger.warning(
+                        f"LLM concurrency limit{' of ' + self.name if self.name else ''} lowered to {int(self.limit)} "
+                        f"({'overload' if overloaded else f'latency {latency:.1f}s'})"
+                    )
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._changed.notify_all()
+        self._report()
+
+    def _report(self):
+        metrics.set("llm_concurrency_limit", int(self.limit), help="Adaptive limit of concurrent LLM calls", backend=self.name)
+        metrics.set("llm_inflight_requests", self.inflight, help="LLM calls in flight", backend=self.name)
+
+
+class TokenBucket:
+    """
+    Rate limit of rate calls per second with bursts of up to burst calls.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> float:
+        """
+        Takes one token, waiting for it if the bucket is empty.
+
+        Returns:
+            Seconds spent waiting
+        """
+        waited = 0.0
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+                waited += delay
+                await asyncio.sleep(delay)
+
+    def try_acquire(self) -> bool:
+        """Takes one token if one is available right now."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
@@ -0,0 +1,82 @@
+from collections import defaultdict
+from typing import Callable, Dict, List, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key: LabelKey) -> str:
+    if not key:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in key)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(key, escaped)) + "}"
+
+
+class Metrics:
+    """
+    Minimal in-process metrics registry rendered in the Prometheus text format.
+
+    Counters only go up, gauges are set to the latest value and summaries keep
+    a count and a sum of observed values. Collectors are called right before
+    rendering, so gauges derived from other state (e.g. queue depth) are
+    always fresh when scraped.
+    """
+
+    def __init__(self):
+        self._types: Dict[str, str] = {}
+        self._help: Dict[str, str] = {}
+        self._values: Dict[str, Dict[LabelKey, float]] = defaultdict(lambda: defaultdict(float))
+        self._collectors: List[Callable[[], None]] = []
+
+    def _register(self, name: str, kind: str, help: str):
+        self._types.setdefault(name, kind)
+        if help:
+            self._help.setdefault(name, help)
+
+    def inc(self, name: str, value: float = 1.0, help: str = "", **labels):
+        """Increments a counter."""
+        self._register(name, "counter", help)
+        self._values[name][_key(labels)] += value
+
+    def set(self, name: str, value: float, help: str = "", **labels):
+        """Sets a gauge."""
+        self._register(name, "gauge", help)
+        self._values[name][_key(labels)] = value
+
+    def observe(self, name: str, value: float, help: str = "", **labels):
+        """Records one observation of a summary."""
+        self._register(name, "summary", help)
+        key = _key(labels)
+        self._values[f"{name}_count"][key] += 1
+        self._values[f"{name}_sum"][key] += value
+
+    def get(self, name: str, **labels) -> float:
+        """Returns the current value of a counter or gauge."""
+        return self._values.get(name, {}).get(_key(labels), 0.0)
+
+    def collector(self, func: Callable[[], None]) -> Callable[[], None]:
+        """Registers a function refreshing gauges before every render."""
+        self._collectors.append(func)
+        return func
+
+    def render(self) -> str:
+        """Returns all metrics in the Prometheus text exposition format."""
+        for collect in self._collectors:
+            collect()
+
+        lines = []
+        for name, kind in sorted(self._types.items()):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+            series = [f"{name}_count", f"{name}_sum"] if kind == "summary" else [name]
+            for series_name in series:
+                for key, value in self._values.get(series_name, {}).items():
+                    lines.append(f"{series_name}{_format_labels(key)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
@@ -0,0 +1,118 @@
+import glob
+import hashlib
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+PROMPTS_DIR = os.getenv("PROMPTS_DIR", ".")
+PROMPTS_GLOB = os.getenv("PROMPTS_GLOB", "*prompt*.txt")
+PROMPTS_CHECK_INTERVAL = float(os.getenv("PROMPTS_CHECK_INTERVAL", 5))
+
+
+@dataclass(frozen=True)
+class Prompt:
+    name: str
+    version: str
+    text: str
+
+
+class PromptRegistry:
+    """
+    Serves prompt files from memory by name and version.
+
+    A file is registered under its name without extension (prompt.txt ->
+    "prompt"); a file named name@version.txt pins an explicit version,
+    otherwise the version is a short hash of the content. The unpinned file
+    is the current version; pinned files are only served when asked for by
+    version, unless a name has no unpinned file at all. Files are checked
+    for changes by mtime at most every check_interval seconds, or on
+    reload(). Earlier versions stay addressable after a change, so templates
+    pinned to a version keep working until the process restarts.
+    """
+
+    def __init__(self, directory: str, pattern: str = "*prompt*.txt", check_interval: float = 5.0):
+        self.directory = directory
+        self.pattern = pattern
+        self.check_interval = check_interval
+        self._versions: Dict[str, Dict[str, Prompt]] = {}
+        self._current: Dict[str, str] = {}
+        # Names whose current version comes from an unpinned file
+        self._unpinned: Set[str] = set()
+        self._mtimes: Dict[str, float] = {}
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.reload()
+
+    @staticmethod
+    def _parse_filename(path: str) -> Tuple[str, Optional[str]]:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        if "@" in stem:
+            name, version = stem.split("@", 1)
+            return name, version
+        return stem, None
+
+    def reload(self) -> List[str]:
+        """
+        Rereads prompt files that are new or changed since the last check.
+
+        Returns:
+            Names of the prompts that were (re)loaded
+        """
+        with self._lock:
+            loaded = []
+            for path in sorted(glob.glob(os.path.join(self.directory, self.pattern))):
+                mtime = os.path.getmtime(path)
+                if self._mtimes.get(path) == mtime:
+                    continue
+                with open(path, encoding="utf-8") as file:
+                    text = file.read()
+                self._mtimes[path] = mtime
+
+                name, pinned = self._parse_filename(path)
+                version = pinned or hashlib.sha256(text.encode("utf-8")).hexdigest()[:8]
+                self._versions.setdefault(name, {})[version] = Prompt(name, version, text)
+                if pinned is None:
+                    self._current[name] = version
+                    self._unpinned.add(name)
+                elif name not in self._unpinned:
+                    # Adding a pinned version must not switch every template to it
+                    self._current.setdefault(name, version)
+                loaded.append(name)
+
+            self._checked_at = time.monotonic()
+            if loaded:
+                logger.info(f"Loaded prompts: {', '.join(f'{n}@{self._current[n]}' for n in loaded)}")
+            return loaded
+
+    def get(self, name: str, version: Optional[str] = None) -> Prompt:
+        """
+        Returns a prompt by name, in its current or in the given version.
+
+        Raises:
+            KeyError: If no such prompt or version was loaded
+        """
+        if time.monotonic() - self._checked_at > self.check_interval:
+            self.reload()
+
+        versions = self._versions.get(name)
+        if not versions:
+            raise KeyError(f"Unknown prompt '{name}'")
+        version = version or self._current[name]
+        if version not in versions:
+            raise KeyError(f"Unknown version '{version}' of prompt '{name}'")
+        return versions[version]
+
+    def list(self) -> Dict[str, Dict[str, object]]:
+        """Returns the current and all known versions of every prompt."""
+        return {
+            name: {"current": self._current[name], "versions": sorted(versions)}
+            for name, versions in self._versions.items()
+        }
+
+
+prompt_registry = PromptRegistry(PROMPTS_DIR, PROMPTS_GLOB, PROMPTS_CHECK_INTERVAL)
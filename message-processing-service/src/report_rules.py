@@ -0,0 +1,247 @@
+"""
+Lexicon rules deciding obvious reports and obvious chatter without the LLM.
+
+A message is scored by the vocabulary of src/data_lists.py (operations,
+cultures, divisions), the abbreviations reports are written with ("Отд",
+"ПУ", "га", "диск", "пах", ...) and numeric patterns such as "41/501" (day
+/ since the start of the operation). Scores at or above the report
+threshold are reports, scores below the talk threshold are chatter, and
+only the band in between goes to the LLM. A message is never decided as
+chatter if it contains a figure or any report vocabulary, since dropping a
+report loses it while an extra LLM call only costs time.
+
+The rules are off unless RULES_ENABLED is set; evaluate them against the
+chatter of the chats they will serve before enabling them.
+
+Reports that clearly describe a single operation (one operation line with
+its total and division rows) are recognised as well, so they can go to
+extraction without the LLM split.
+
+Evaluation against labelled messages (from the service directory):
+    python -m src.report_rules prompts.csv [--negatives chatter.txt]
+
+Rows of a one-column CSV count as reports; a "label" column (REPORT/TALK)
+or a --negatives file with one message per line adds chatter.
+"""
+import argparse
+import csv
+import os
+import re
+from typing import Iterable, List, Optional, Tuple
+
+from src.data_lists import CULTURES, DIVISIONS, OPERATIONS
+
+RULES_ENABLED = os.getenv("RULES_ENABLED", "false").lower() in ("1", "true", "yes")
+# Scores at or above RULES_REPORT_THRESHOLD are reports, below RULES_TALK_THRESHOLD chatter
+RULES_REPORT_THRESHOLD = float(os.getenv("RULES_REPORT_THRESHOLD", 5))
+RULES_TALK_THRESHOLD = float(os.getenv("RULES_TALK_THRESHOLD", 1))
+# Send reports recognised as a single operation to extraction without the LLM split
+SPLIT_RULES_ENABLED = os.getenv("SPLIT_RULES_ENABLED", "true").lower() in ("1", "true", "yes")
+
+WORD = re.compile(r"[а-яёa-z]+")
+# "41/501", "26 / 488": hectares per day / since the start of the operation
+AREA_PAIR = re.compile(r"\d+(?:[.,]\d+)?\s*/\s*\d+")
+HECTARES = re.compile(r"\d\s*га\b|\bга\b|гектар")
+DIGIT = re.compile(r"\d")
+DATE = re.compile(r"\b\d{1,2}\.\d{1,2}(?:\.\d{2,4})?\b")
+# Lines a single-operation report consists of besides its operation line
+TOTAL_LINE = re.compile(r"^(?:по\s*)?пу(?![а-я])")
+DIVISION_LINE = re.compile(r"^отд\s*\d")
+DATE_LINE = re.compile(r"^\d{1,2}\.\d{1,2}(?:\.\d{2,4})?\s*(?:день|ночь)?$")
+
+STEM_LENGTH = 5
+# Short forms used in reports that the word lists do not contain
+ABBREVIATIONS = {
+    "отд", "пу", "га", "диск", "дисков", "пах", "вспаш", "культ", "предп", "подс", "сах", "св", "оз", "пш",
+    "пшен", "зяби", "зябь", "мн", "тр", "кук", "сои", "сою", "силос", "агрегат", "остаток",
+}
+# Short forms of operations too short for a stem
+OPERATION_ABBREVIATIONS = {"пах", "диск", "сев", "вспаш", "герб"}
+# Stems of the verbs operations are reported with ("Вспахали", "Опрыскали", "Посеяли")
+VERB_STEMS = {
+    "вспах", "пропа", "опрыс", "посея", "засея", "сеяли", "убрал", "убран", "скоси", "скоше", "проди", "отдис",
+    "внесл", "обмол", "намол",
+}
+
+
+def _stems(phrases: Iterable[str]) -> set:
+    return {word[:STEM_LENGTH] for phrase in phrases for word in WORD.findall(phrase.lower()) if len(word) > 3}
+
+
+# Stems shared by both lists (e.g. "озим") count once, as operations
+OPERATION_STEMS = _stems(OPERATIONS) - {"обраб"}
+CULTURE_STEMS = _stems(CULTURES) - OPERATION_STEMS
+# Division names are matched case-sensitively: "Мир" is a division, "мир" a word
+DIVISION_PATTERN = re.compile(r"\b(?:" + "|".join(re.escape(name) for name in sorted(DIVISIONS, key=len, reverse=True)) + r")\b")
+
+
+def _vocabulary(words: List[str]) -> Tuple[set, set, set]:
+    """
+    Returns the operations, cultures and abbreviations among the words of a message.
+    """
+    operations = {word[:STEM_LENGTH] for word in words if word[:STEM_LENGTH] in OPERATION_STEMS or word[:STEM_LENGTH] in VERB_STEMS}
+    cultures = {word[:STEM_LENGTH] for word in words if word[:STEM_LENGTH] in CULTURE_STEMS}
+    abbreviations = {word for word in words if word in ABBREVIATIONS}
+    return operations, cultures, abbreviations
+
+
+def score(text: str) -> float:
+    """
+    Returns how much a message looks like an agronomic report.
+    """
+    lowered = text.lower().replace("ё", "е")
+    operations, cultures, abbreviations = _vocabulary(WORD.findall(lowered))
+
+    total = 0.0
+    total += min(len(operations), 3) * 1.5
+    total += min(len(cultures), 3) * 1.0
+    total += min(len(abbreviations), 4) * 0.75
+    total += min(len(AREA_PAIR.findall(lowered)), 3) * 2.0
+    total += 1.5 if HECTARES.search(lowered) else 0.0
+    total += 1.5 if DIVISION_PATTERN.search(text) else 0.0
+    total += 0.5 if DATE.search(lowered) else 0.0
+    return total
+
+
+def classify(text: str) -> Optional[bool]:
+    """
+    Returns True for an obvious report, False for obvious chatter and None if the LLM should decide.
+    """
+    value = score(text)
+    if value >= RULES_REPORT_THRESHOLD:
+        return True
+    if value < RULES_TALK_THRESHOLD and not is_possible_report(text):
+        return False
+    return None
+
+
+def is_possible_report(text: str) -> bool:
+    """
+    Returns True if a message contains a figure or any report vocabulary, however little.
+    """
+    if DIGIT.search(text) or HECTARES.search(text.lower()) or DIVISION_PATTERN.search(text):
+        return True
+    return any(_vocabulary(WORD.findall(text.lower().replace("ё", "е"))))
+
+
+def is_single_operation(text: str) -> bool:
+    """
+    Returns True if a report clearly describes a single operation and needs no split.
+
+    Such a report is one operation line ("Пахота зяби под сою"), optionally
+    preceded by date or division lines and followed by at most one total
+    line ("По Пу 26/488") and division rows ("Отд 12 26/221"). A second
+    operation, free-text remarks or several figures on one line leave the
+    report to the LLM split.
+    """
+    operation_lines = total_lines = 0
+    for line in text.splitlines():
+        lowered = line.strip().lower().replace("ё", "е")
+        if not lowered:
+            continue
+        pairs = len(AREA_PAIR.findall(lowered))
+        words = WORD.findall(lowered)
+        positions = [i for i, word in enumerate(words) if word[:STEM_LENGTH] in OPERATION_STEMS or word in OPERATION_ABBREVIATIONS]
+        if positions:
+            operation_lines += 1
+            if operation_lines > 1 or pairs > 1:
+                return False
+            # One operation is named by adjacent words ("Предп культ"), "Пахота и дискование" are two
+            named = words[positions[0]:positions[-1] + 1]
+            if len(named) > 3 or "и" in named:
+                return False
+        elif TOTAL_LINE.match(lowered) or DIVISION_LINE.match(lowered):
+            if not operation_lines or pairs > 1:
+                return False
+            if TOTAL_LINE.match(lowered):
+                total_lines += 1
+                if total_lines > 1:
+                    return False
+        else:
+            # Only a date and division names may precede the operation line
+            rest = DIVISION_PATTERN.sub("", line).strip().lower()
+            if operation_lines or (rest and not DATE_LINE.match(rest)):
+                return False
+    return operation_lines == 1
+
+
+def load_labelled(path: str, negatives: Optional[str] = None) -> List[Tuple[str, bool]]:
+    """
+    Loads messages labelled as reports (True) or chatter (False) for evaluation.
+    """
+    samples = []
+    with open(path, encoding="utf-8", newline="") as file:
+        rows = [row for row in csv.reader(file) if row and row[0].strip()]
+    header = [cell.strip().lower() for cell in rows[0]] if rows else []
+    if "label" in header:
+        text_column = header.index("text") if "text" in header else 0
+        label_column = header.index("label")
+        samples += [(row[text_column], row[label_column].strip().upper() == "REPORT") for row in rows[1:]]
+    else:
+        # A one-column file of reports; its first row is a caption
+        samples += [(row[0], True) for row in rows[1:]]
+
+    if negatives:
+        with open(negatives, encoding="utf-8") as file:
+            samples += [(line.strip(), False) for line in file if line.strip()]
+    return samples
+
+
+def evaluate(samples: List[Tuple[str, bool]]) -> dict:
+    """
+    Returns precision and recall of the rule decisions and the share of LLM calls they avoid.
+    """
+    counts = {"tp": 0, "fp": 0, "tn": 0, "fn": 0, "ambiguous": 0}
+    for text, is_report in samples:
+        decision = classify(text)
+        if decision is None:
+            counts["ambiguous"] += 1
+        elif decision:
+            counts["tp" if is_report else "fp"] += 1
+        else:
+            counts["fn" if is_report else "tn"] += 1
+
+    reports = sum(1 for _, is_report in samples if is_report)
+    decided_reports = counts["tp"] + counts["fp"]
+    decided_talk = counts["tn"] + counts["fn"]
+    return {
+        "messages": len(samples),
+        "reports": reports,
+        **counts,
+        "precision": counts["tp"] / decided_reports if decided_reports else None,
+        "recall": counts["tp"] / reports if reports else None,
+        "talk_precision": counts["tn"] / decided_talk if decided_talk else None,
+        "llm_calls_avoided": (len(samples) - counts["ambiguous"]) / len(samples) if samples else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the lexicon rules on labelled messages")
+    parser.add_argument("path", nargs="?", default="prompts.csv")
+    parser.add_argument("--negatives", help="Text file with one chatter message per line")
+    parser.add_argument("--verbose", action="store_true", help="Print every message that was not decided correctly")
+    args = parser.parse_args()
+
+    samples = load_labelled(args.path, args.negatives)
+    if args.verbose:
+        for text, is_report in samples:
+            decision = classify(text)
+            if decision != is_report:
+                decided = "LLM" if decision is None else "REPORT" if decision else "TALK"
+                print(f"[{'REPORT' if is_report else 'TALK'} -> {decided}] score {score(text):.2f}: {text[:80]!r}")
+
+    result = evaluate(samples)
+    print(f"Messages: {result['messages']} ({result['reports']} reports)")
+    print(f"Decided as report: {result['tp']} correct, {result['fp']} wrong; as chatter: {result['tn']} correct, {result['fn']} wrong")
+    print(f"Sent to the LLM: {result['ambiguous']}")
+    for name in ("precision", "recall", "talk_precision"):
+        value = result[name]
+        print(f"{name.replace('_', ' ').capitalize()}: {'n/a' if value is None else f'{value:.1%}'}")
+    print(f"LLM calls avoided: {result['llm_calls_avoided']:.1%}")
+    reports = [text for text, is_report in samples if is_report]
+    single = sum(1 for text in reports if is_single_operation(text))
+    print(f"Single-operation reports (no LLM split): {single} of {len(reports)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,15 +2,69 @@ import asyncio
 
 import json
 
+import os
+
+from typing import Any, List, Optional
+
 from src.llm import chat
 
-from src.bert import is_report_bert
+from src import bert
 
 from src.online_log import log
 
+from src.prompts import prompt_registry
+
+from src.metrics import metrics
+
+from src import report_rules
+
+from src.batching import MicroBatcher
+
 STRAGEGY = "CSV"
 MODEL_NAME = "Mistral"
 
+# Model per pipeline stage ("stage:model,..."), stages not listed use LLM_DEFAULT_MODEL.
+# A template may override them for its chats with a "stageModels" object, e.g. {"extract_csv": "yagpt-pro"}
+LLM_DEFAULT_MODEL = os.getenv("LLM_DEFAULT_MODEL", "yagpt")
+LLM_STAGE_MODELS = {
+    stage.strip(): model.strip()
+    for stage, model in (item.split(":", 1) for item in os.getenv("LLM_STAGE_MODELS", "").split(",") if item.strip())
+}
+
+def stage_model(stage: str, template: Optional[dict] = None) -> str:
+    """
+    Returns the model a pipeline stage runs on, for the given template if any.
+    """
+    overrides = (template or {}).get("stageModels") or {}
+    return overrides.get(stage) or LLM_STAGE_MODELS.get(stage, LLM_DEFAULT_MODEL)
+
+# Micro-batching of LLM report classification: messages arriving within CLASSIFY_BATCH_WINDOW_MS
+# of each other are classified by one call, up to CLASSIFY_BATCH_MAX per call (0 disables batching)
+CLASSIFY_BATCH_WINDOW = float(os.getenv("CLASSIFY_BATCH_WINDOW_MS", 0)) / 1000
+CLASSIFY_BATCH_MAX = int(os.getenv("CLASSIFY_BATCH_MAX", 16))
+
+IS_REPORT_PROMPT = f"Ты - {MODEL_NAME}, очень точная и интеллектуальная модель классификации агрономических отчётов. Тебе будет дано сообщение из чата и всё что тебе нужно сделать это определить является ли оно агрономическим отчётом. Агрономический отчет - сообщение в свободной форме с информацией о каких-то операциях на полях. Подумай и если это сообщение является отчётом, напиши 'REPORT', если оно не является отчётом, напиши 'TALK'.\nПримеры отчётов:\n1)\nСевер \nОтд7 пах с св 41/501\nОтд20 20/281 по пу 61/793\nОтд 3 пах подс.60/231\nПо пу 231\n\nДиск к. Сил отд 7. 32/352\nПу- 484\nДиск под Оз п езубов 20/281\nДиск под с. Св отд 10 83/203 пу-1065га\n\n2)\nПривет, по отделу 7 прошлись пахотой сах свеклы 41/501.\n\nИ другие. Если сообщение хоть как-то похоже на агрономический отчёт, пиши 'REPORT'."
+
+IS_REPORT_BATCH_INSTRUCTIONS = "Внимание: тебе будет дано сразу несколько сообщений, каждое в теге message со своим id. Классифицируй каждое сообщение отдельно и независимо от остальных. Формат вывода: json обьект с полем results - массивом обьектов с полями id (id сообщения) и label ('REPORT' или 'TALK'), по одному для каждого сообщения. Не выводи никакой разметки кроме корректного json."
+
+IS_REPORT_BATCH_STRUCTURE = {
+    "type": "object",
+    "properties": {
+        "results": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "string"},
+                    "label": {"type": "string", "enum": ["REPORT", "TALK"]}
+                },
+                "required": ["id", "label"]
+            }
+        }
+    },
+    "required": ["results"]
+}
+
 async def agentic(history: list, message: str):
     
     payload = history
@@ -32,22 +86,57 @@ async def agentic(history: list, message: str):
     else:
         payload.append({ "role": "user", "content": f"{message}" })
     
-    result = await chat("yagpt", payload)
+    result = await chat(stage_model("agentic"), payload, stage="agentic")
     result = result.choices[0].message.content
     
     payload.append({ "role": "assistant", "content": result })
     
     return {"history": payload, "answer": result}
 
-async def is_report(message: str, use_bert: bool = False) -> bool:
-    if use_bert:
-        from bert import is_report_bert
-        return await is_report_bert(message)
-    
+async def is_report(message: str, use_bert: Optional[bool] = None) -> bool:
+    """
+    Classifies a message as a report through a cascade: lexicon rules decide
+    obvious cases, then the BERT classifier decides confident ones (in
+    "cascade" mode), and only the rest goes to the LLM.
+
+    Args:
+        message: Text of the message
+        use_bert: Overrides BERT_MODE: True for "cascade", False for "off"
+    """
+    # Obvious reports and chatter are decided locally, only the rest goes to a model
+    if report_rules.RULES_ENABLED:
+        decision = report_rules.classify(message)
+        if decision is not None:
+            metrics.inc("is_report_decisions_total", help="Report classifications by classifier and result", classifier="rules", result="REPORT" if decision else "TALK")
+            return decision
+
+    mode = bert.BERT_MODE if use_bert is None else "cascade" if use_bert else "off"
+    if mode == "cascade":
+        probability = await bert.report_probability(message)
+        decision = bert.decide(probability)
+        if decision is not None:
+            metrics.inc("is_report_decisions_total", classifier="bert", result="REPORT" if decision else "TALK")
+            return decision
+        result = await is_report_llm(message)
+    elif mode == "shadow":
+        result, probability = await asyncio.gather(is_report_llm(message), bert.report_probability(message))
+    else:
+        return await is_report_llm(message)
+
+    if probability is not None:
+        bert.record_agreement(message, probability, result)
+    return result
+
+async def is_report_llm(message: str) -> bool:
+    if CLASSIFY_BATCH_WINDOW > 0:
+        return await classification_batcher.submit(message)
+    return await is_report_single(message)
+
+async def is_report_single(message: str) -> bool:
     payload = [
         {
             "role": "system",
-            "content": f"Ты - {MODEL_NAME}, очень точная и интеллектуальная модель классификации агрономических отчётов. Тебе будет дано сообщение из чата и всё что тебе нужно сделать это определить является ли оно агрономическим отчётом. Агрономический отчет - сообщение в свободной форме с информацией о каких-то операциях на полях. Подумай и если это сообщение является отчётом, напиши 'REPORT', если оно не является отчётом, напиши 'TALK'.\nПримеры отчётов:\n1)\nСевер \nОтд7 пах с св 41/501\nОтд20 20/281 по пу 61/793\nОтд 3 пах подс.60/231\nПо пу 231\n\nДиск к. Сил отд 7. 32/352\nПу- 484\nДиск под Оз п езубов 20/281\nДиск под с. Св отд 10 83/203 пу-1065га\n\n2)\nПривет, по отделу 7 прошлись пахотой сах свеклы 41/501.\n\nИ другие. Если сообщение хоть как-то похоже на агрономический отчёт, пиши 'REPORT'."  
+            "content": IS_REPORT_PROMPT
         },
         {
             "role": "user",
@@ -55,15 +144,74 @@ async def is_report(message: str, use_bert: bool = False) -> bool:
         }
     ]
     
-    result = await chat("yagpt", payload)
+    result = await chat(stage_model("is_report"), payload, stage="is_report", cacheable=lambda content: "REPORT" in content or "TALK" in content)
     result = result.choices[0].message.content
     
+    metrics.inc("is_report_decisions_total", classifier="llm", result="REPORT" if 'REPORT' in result else "TALK")
     return 'REPORT' in result
 
-async def split_report(message: str, prompt = None) -> list:
+async def is_report_batch(messages: List[str]) -> List[Optional[bool]]:
+    """
+    Classifies several messages with one LLM call.
+
+    Returns:
+        One result per message, None for messages missing from the answer
+    """
+    payload = [
+        {
+            "role": "system",
+            "content": IS_REPORT_PROMPT + "\n\n" + IS_REPORT_BATCH_INSTRUCTIONS
+        },
+        {
+            "role": "user",
+            "content": "Вот сообщения, которые тебе необходимо классифицировать:\n\n" + "\n\n".join(
+                f"<message id=\"{index}\">\n{message}\n</message>" for index, message in enumerate(messages)
+            )
+        }
+    ]
+    
+    result = await chat(
+        stage_model("is_report"),
+        payload,
+        structure=IS_REPORT_BATCH_STRUCTURE,
+        stage="is_report_batch",
+        cacheable=lambda content: isinstance(parse_json_answer(content)["results"], list),
+    )
+    parsed = parse_json_answer(result.choices[0].message.content)
+    
+    labels = {str(item.get("id")): item.get("label") for item in parsed.get("results", []) if isinstance(item, dict)}
+    results = []
+    for index in range(len(messages)):
+        label = labels.get(str(index))
+        results.append(label == "REPORT" if label in ("REPORT", "TALK") else None)
+        if results[-1] is not None:
+            metrics.inc("is_report_decisions_total", classifier="llm_batch", result=label)
+    return results
+
+classification_batcher = MicroBatcher(
+    "is_report",
+    is_report_batch,
+    is_report_single,
+    window=CLASSIFY_BATCH_WINDOW,
+    max_batch=CLASSIFY_BATCH_MAX,
+)
+
+def parse_json_answer(content: str) -> Any:
+    """
+    Parses the JSON object of an LLM answer, ignoring text the LLM put before or after it.
+    """
+    if '{' in content and '}' in content:
+        content = content[content.find('{'):content.rfind('}')+1]
+    return json.loads(content)
+
+async def split_report(message: str, prompt = None, prompt_name: str = None, prompt_version: str = None, model: str = None) -> list:
     instr = f"Пользователь даст тебе отчёт из чата и перед тобой стоит задача разделить его по операциям. Исходный формат в свободном стиле и может иметь сокращения. Вот возможные операции: 1-я междурядная культивация, 2-я междурядная культивация, Боронование довсходовое, Внесение минеральных удобрений, Выравнивание зяби, 2-е Выравнивание зяби, Гербицидная обработка, 1 Гербицидная обработка, 2 Гербицидная обработка, 3 Гербицидная обработка, 4 Гербицидная обработка, Дискование, Дискование 2-е, Инсектицидная обработка, Культивация, Пахота, Подкормка, Предпосевная культивация, Прикатывание посевов, Сев, Сплошная культивация, Уборка, Функицидная обработка, Чизлевание. Твоя задача - вывести списком разделенные по операциям сообщения. Для каждой операции из исходного сообщения нужно в точности переписать все относящиеся к нему данные. Если в сообщении была информация относящаяся ко всем операциям - дата для всех сообщений или название подразделений, тебе нужно переписать их в дополнении к каждому разделенному сообщению с операцией. Некоторые операции могут быть не полными и содержать не все поля. Внимание, формат вывода: тебе нужно вывести результат в качестве json обьекта с полем separated_reports типа массива строк. Json должен быть корректным для парсинга. Не выводи никакой разметки кроме корректного json."
+    version = None
+    if prompt_name:
+        registered = prompt_registry.get(prompt_name, prompt_version)
+        instr, version = registered.text, registered.version
     if prompt:
-        instr =  prompt
+        instr, version = prompt, None
     
     payload = [
         {
@@ -89,17 +237,16 @@ async def split_report(message: str, prompt = None) -> list:
         "required": ["separated_reports"]
     }
     
-    result = await chat("yagpt", payload, structure=structure)
+    result = await chat(
+        model or stage_model("split_report"),
+        payload,
+        structure=structure,
+        stage="split_report",
+        prompt_version=version,
+        cacheable=lambda content: len(parse_json_answer(content).get("separated_reports", [])) > 0,
+    )
     try:
-        content = result.choices[0].message.content
-        # In case LLM returns text before or after the JSON
-        if '{' in content and '}' in content:
-            json_part = content[content.find('{'):content.rfind('}')+1]
-            parsed_result = json.loads(json_part)
-        else:
-            parsed_result = json.loads(content)
-            
-        return parsed_result.get("separated_reports", [])
+        return parse_json_answer(result.choices[0].message.content).get("separated_reports", [])
     except json.JSONDecodeError as e:
         print(f"Error parsing JSON response: {e}")
         print(f"Raw content: {result.choices[0].message.content}")
@@ -107,20 +254,47 @@ async def split_report(message: str, prompt = None) -> list:
 
 
 
-async def extract_data_from_message(message: str, template: dict) -> dict:
-    result = []
+async def split_with_template(message: str, template: dict) -> list:
+    if report_rules.SPLIT_RULES_ENABLED and report_rules.is_single_operation(message):
+        metrics.inc("split_decisions_total", help="Reports split by the LLM or passed on whole as a single operation", splitter="rules")
+        log("Task split skipped for a single-operation report", level="info", source="split_report")
+        return [message]
+    metrics.inc("split_decisions_total", splitter="llm")
     
     print("TASK SPLIT PROMPT", template.get("taskSplitPrompt"))
     
-    split = await split_report(message, template.get("taskSplitPrompt"))
+    split = await split_report(
+        message,
+        template.get("taskSplitPrompt"),
+        template.get("splitPromptName"),
+        template.get("splitPromptVersion"),
+        stage_model("split_report", template),
+    )
     log(f"Task split result: {split}", level="info", source="split_report")
+    return split
+
+async def extract_data_from_message(message: str, template: dict, split: Optional[list] = None) -> dict:
+    result = []
     
-    tasks = [extract_csv(msg, template.get("systemPrompt")) for msg in split]
+    # The split may have been made speculatively while the message was classified
+    if split is None:
+        split = await split_with_template(message, template)
+    
+    tasks = [
+        extract_csv(
+            msg,
+            template.get("systemPrompt"),
+            template.get("promptName", "prompt"),
+            template.get("promptVersion"),
+            stage_model("extract_csv", template),
+        )
+        for msg in split
+    ]
     result = await asyncio.gather(*tasks)
     
     return result
 
-async def determine_questions(table: str) -> dict:
+async def determine_questions(table: str, model: str = None) -> dict:
     payload = [
         {
             "role": "system",
@@ -132,7 +306,7 @@ async def determine_questions(table: str) -> dict:
         }
     ]
     
-    result = await chat("yagpt", payload)
+    result = await chat(model or stage_model("determine_questions"), payload, stage="determine_questions")
     return result.choices[0].message.content
         
 
@@ -154,29 +328,10 @@ async def get_history_for_followup(table: str, assistant_message: str) -> dict:
     
     return payload
 
-async def extract_csv(message: str, prompt = None) -> dict:
-    inst = open('prompt.txt', encoding='utf-8').read()
-    
-    if prompt:
-        inst = prompt
-    
-    payload = [
-        {
-            "role": "system",
-            "content": inst
-        },
-        {
-            "role": "user",
-            "content": f"Вот сообщение, которое тебе необходимо обработать: {message}"
-        }
-    ]
-    
-    result = await chat("yagpt", payload)
-    result = result.choices[0].message.content
-    
-    print(result)
-    
-    
+def parse_extraction(result: str) -> dict:
+    """
+    Parses the csv table and the question of an extract_csv answer.
+    """
     csv_data = None
     data = []
     if "```csv" in result:
@@ -205,11 +360,43 @@ async def extract_csv(message: str, prompt = None) -> dict:
     
     if question == "": question = None
     
-    result_dict = {
+    return {
         "data": data,
         "question": question,
         "success": len(data) > 0
     }
+
+async def extract_csv(message: str, prompt = None, prompt_name: str = "prompt", prompt_version: str = None, model: str = None) -> dict:
+    version = None
+    if prompt:
+        inst = prompt
+    else:
+        registered = prompt_registry.get(prompt_name, prompt_version)
+        inst, version = registered.text, registered.version
+    
+    payload = [
+        {
+            "role": "system",
+            "content": inst
+        },
+        {
+            "role": "user",
+            "content": f"Вот сообщение, которое тебе необходимо обработать: {message}"
+        }
+    ]
+    
+    result = await chat(
+        model or stage_model("extract_csv"),
+        payload,
+        stage="extract_csv",
+        prompt_version=version,
+        cacheable=lambda content: parse_extraction(content)["success"],
+    )
+    result = result.choices[0].message.content
+    
+    print(result)
+    
+    result_dict = parse_extraction(result)
     
     log(f"Extracted CSV data: {result_dict}", level="info", source="extract_csv")
     
@@ -0,0 +1,100 @@
+import logging
+import time
+from typing import Dict, List, Optional
+
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Job classes: private follow-up turns a user is waiting for, and bulk group reports
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+
+class WeightedFairScheduler:
+    """
+    Picks the next job among the eligible heads of the job queue.
+
+    Interactive jobs always go first. While private conversations are
+    active - an interactive job is running or started within the last
+    interactive_slo seconds - bulk jobs may only occupy workers -
+    reserved_interactive workers, so a private reply never waits for a
+    burst of group reports to drain. Without interactive traffic the
+    reservation is lifted and bulk jobs use every worker. Within a class,
+    chats share the workers by start-time fair queuing: every chat carries
+    a virtual finish tag advanced by 1 / weight per started job, and the
+    chat with the smallest tag is served next, so one busy chat cannot
+    starve the others.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        reserved_interactive: int = 1,
+        interactive_slo: float = 30.0,
+        chat_weights: Optional[Dict[str, float]] = None,
+    ):
+        self.workers = workers
+        self.reserved_interactive = min(reserved_interactive, max(workers - 1, 0))
+        self.interactive_slo = interactive_slo
+        self.chat_weights = chat_weights or {}
+
+        self.running: Dict[str, int] = {INTERACTIVE: 0, BULK: 0}
+        self._last_interactive_start = float("-inf")
+        self._virtual_time: Dict[str, float] = {INTERACTIVE: 0.0, BULK: 0.0}
+        self._finish_tags: Dict[str, Dict[str, float]] = {INTERACTIVE: {}, BULK: {}}
+
+    def _start_tag(self, job_class: str, chat_id: str) -> float:
+        return max(self._virtual_time[job_class], self._finish_tags[job_class].get(chat_id, 0.0))
+
+    def pick(self, candidates: List) -> Optional[object]:
+        """
+        Chooses one of the candidate job rows, or None if none may start now.
+        Candidates are expected to hold at most one (the oldest) job per class and chat.
+        """
+        by_class: Dict[str, List] = {INTERACTIVE: [], BULK: []}
+        for row in candidates:
+            by_class[row["job_class"] if row["job_class"] == INTERACTIVE else BULK].append(row)
+
+        if by_class[INTERACTIVE]:
+            job_class = INTERACTIVE
+        elif by_class[BULK] and self.running[BULK] < self.workers - self._reserved():
+            job_class = BULK
+        else:
+            return None
+
+        rows = by_class[job_class]
+        return min(rows, key=lambda row: (self._start_tag(job_class, row["chat_id"] or ""), row["id"]))
+
+    def _reserved(self) -> int:
+        # Work-conserving: workers are only held back while private conversations are active
+        active = self.running[INTERACTIVE] > 0 or time.monotonic() - self._last_interactive_start < self.interactive_slo
+        return self.reserved_interactive if active else 0
+
+    def started(self, row):
+        """Accounts a job that a worker has claimed."""
+        job_class = INTERACTIVE if row["job_class"] == INTERACTIVE else BULK
+        chat_id = row["chat_id"] or ""
+        start = self._start_tag(job_class, chat_id)
+        self._virtual_time[job_class] = start
+        self._finish_tags[job_class][chat_id] = start + 1.0 / self.chat_weights.get(chat_id, 1.0)
+        self.running[job_class] += 1
+        if job_class == INTERACTIVE:
+            self._last_interactive_start = time.monotonic()
+
+        wait = time.time() - row["created_at"]
+        metrics.observe("message_queue_wait_by_class_seconds", wait, help="Queue wait of started jobs by class", job_class=job_class)
+        if job_class == INTERACTIVE and wait > self.interactive_slo:
+            metrics.inc("interactive_slo_violations_total", help="Interactive jobs started after their latency SLO")
+            logger.warning(f"Interactive job {row['id']} waited {wait:.1f}s, over the {self.interactive_slo:.0f}s SLO")
+
+    def finished(self, row):
+        """Accounts a job that a worker has finished."""
+        job_class = INTERACTIVE if row["job_class"] == INTERACTIVE else BULK
+        self.running[job_class] = max(self.running[job_class] - 1, 0)
+
+        # Forget chats that are idle relative to the virtual clock to keep the table small
+        finish_tags = self._finish_tags[job_class]
+        if len(finish_tags) > 10000:
+            now = self._virtual_time[job_class]
+            self._finish_tags[job_class] = {chat: tag for chat, tag in finish_tags.items() if tag > now}
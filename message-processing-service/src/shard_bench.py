@@ -0,0 +1,200 @@
+"""
+Local throughput test for sender-affinity sharding.
+
+Starts a mock backend (LLM, data service, WhatsApp and file service on one
+port) and N message-processing nodes on this machine, all sharing one
+external agent state database. Reports from many senders are posted
+round-robin to the nodes, which route them to their owners by consistent
+hashing on sender_id, and the time until every job is done is measured.
+
+Usage (from the service directory):
+    python -m src.shard_bench --nodes 1 4 --messages 400
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import aiohttp
+from aiohttp import web
+
+MOCK_PORT = 8199
+BASE_PORT = 8101
+REPORT = """Пахота зяби под сою
+По ПУ 7/1402
+Отд 17 7/141"""
+CSV_ANSWER = (
+    "```csv\nДата;Подразделение;Операция;Культура;За день, га;С начала операции, га\n"
+    "01.10;АОР;Пахота;Соя товарная;7;141\n```"
+)
+
+
+def mock_backend(llm_latency: float) -> web.Application:
+    """Builds an app answering every downstream call of the pipeline."""
+
+    async def completions(request: web.Request) -> web.Response:
+        body = await request.json()
+        await asyncio.sleep(llm_latency)
+        user = body["messages"][-1]["content"]
+        if "json_schema" in body:
+            content = json.dumps({"separated_reports": [user]}, ensure_ascii=False)
+        elif "классифицировать" in user:
+            content = "REPORT"
+        else:
+            content = CSV_ANSWER
+        return web.json_response({
+            "id": uuid.uuid4().hex,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        })
+
+    async def chat(request: web.Request) -> web.Response:
+        return web.json_response({"chat_id": request.match_info["chat_id"], "active": True, "template_id": "bench"})
+
+    async def template(request: web.Request) -> web.Response:
+        template = {
+            "_id": "bench",
+            "name": "bench",
+            "columns": ["Дата", "Подразделение", "Операция", "Культура", "За день, га", "С начала операции, га"],
+        }
+        # Without an id the service lists all templates
+        return web.json_response(template if "id" in request.query else [template])
+
+    async def ok(request: web.Request) -> web.Response:
+        return web.json_response({"success": True})
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", completions)
+    app.router.add_get("/api/chats/{chat_id}", chat)
+    app.router.add_get("/api/templates", template)
+    app.router.add_route("*", "/{tail:.*}", ok)
+    return app
+
+
+def start_nodes(count: int, workdir: str) -> list:
+    """Starts count uvicorn nodes configured as one shard ring."""
+    urls = [f"http://127.0.0.1:{BASE_PORT + i}" for i in range(count)]
+    backend = f"http://127.0.0.1:{MOCK_PORT}"
+    processes = []
+    for i, url in enumerate(urls):
+        env = {
+            **os.environ,
+            "LLM_SERVICE_URL": f"{backend}/v1",
+            "DATA_SERVICE_URL": backend,
+            "FILE_SERVICE_URL": backend,
+            "WHATSAPP_SERVICE_URL": backend,
+            "JOB_QUEUE_DB": os.path.join(workdir, f"jobs-{i}.db"),
+            "AGENT_STORE_DB": os.path.join(workdir, "agents.db"),
+            "IDEMPOTENCY_DB": os.path.join(workdir, f"idempotency-{i}.db"),
+            "LLM_CACHE_DB": os.path.join(workdir, f"llm_cache-{i}.db"),
+            # The mock answers must not be cached, here or in the service's own cache, and identical
+            # bench reports would otherwise measure cache hits rather than processing
+            "LLM_CACHE_TTLS": "",
+            # Every stage has to reach the mock LLM, not be decided by the local rules
+            "RULES_ENABLED": "false",
+            "SPLIT_RULES_ENABLED": "false",
+            "AGENT_STATE_MODE": "external",
+            # Every posted message has to become its own job, or fewer jobs than messages ever finish
+            "DEBOUNCE_SECONDS": "0",
+            "SHARD_NODES": ",".join(urls),
+            "SHARD_SELF": url,
+        }
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(BASE_PORT + i),
+             "--log-level", "warning"],
+            env=env,
+        ))
+    return urls, processes
+
+
+async def wait_ready(session: aiohttp.ClientSession, urls: list):
+    for url in urls:
+        for _ in range(100):
+            try:
+                async with session.get(f"{url}/queue") as response:
+                    if response.status == 200:
+                        break
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+
+
+async def run(count: int, messages: int, senders: int, workdir: str) -> float:
+    urls, processes = start_nodes(count, workdir)
+    try:
+        async with aiohttp.ClientSession() as session:
+            await wait_ready(session, urls)
+            started = time.time()
+
+            async def post(i: int):
+                # One chat per sender, so the per-chat admission limit does not reject the burst.
+                # Each report is unique, so no LLM call is shared with another message's in flight
+                payload = {
+                    "message_id": f"bench_{uuid.uuid4().hex}",
+                    "source_name": "whatsapp",
+                    "chat_id": f"bench_{i % senders}@g.us",
+                    "text": f"{REPORT}\nСообщение {i}",
+                    "sender_name": "Bench",
+                    "sender_id": f"sender_{i % senders}",
+                }
+                async with session.post(f"{urls[i % count]}/new_message", json=payload) as response:
+                    await response.read()
+                    if response.status != 200:
+                        raise RuntimeError(f"Message {i} was not accepted: {response.status}")
+
+            await asyncio.gather(*(post(i) for i in range(messages)))
+
+            while True:
+                done = 0
+                for url in urls:
+                    async with session.get(f"{url}/queue") as response:
+                        stats = await response.json()
+                        done += stats["done"] + stats["failed"]
+                if done >= messages:
+                    return time.time() - started
+                await asyncio.sleep(0.2)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Sharded message-processing throughput test")
+    parser.add_argument("--nodes", type=int, nargs="+", default=[1, 4], help="Node counts to compare")
+    parser.add_argument("--messages", type=int, default=400)
+    parser.add_argument("--senders", type=int, default=100)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Simulated seconds per LLM call")
+    args = parser.parse_args()
+
+    runner = web.AppRunner(mock_backend(args.llm_latency))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", MOCK_PORT).start()
+
+    baseline = None
+    try:
+        for count in args.nodes:
+            workdir = tempfile.mkdtemp(prefix="shard_bench_")
+            try:
+                elapsed = await run(count, args.messages, args.senders, workdir)
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+            throughput = args.messages / elapsed
+            baseline = baseline or throughput
+            print(f"{count} node(s): {args.messages} messages in {elapsed:.1f}s - "
+                  f"{throughput:.1f} msg/s ({throughput / baseline:.2f}x)")
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
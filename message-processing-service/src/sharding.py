@@ -0,0 +1,57 @@
+import bisect
+import hashlib
+from typing import List, Optional
+
+# Header set on requests forwarded between nodes, so they are never forwarded twice
+SHARD_HEADER = "X-Shard-Forwarded-By"
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping sender ids to the node that owns them.
+
+    Every node is placed on the ring many times (virtual nodes), so keys are
+    spread evenly and adding or removing a node only moves the keys of the
+    ring segments it owned.
+    """
+
+    def __init__(self, nodes: List[str], replicas: int = 128):
+        self.nodes = list(nodes)
+        ring = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas))
+        self._keys = [h for h, _ in ring]
+        self._owners = [node for _, node in ring]
+
+    def owner(self, key: str) -> str:
+        """Returns the node owning the given key."""
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._owners[index]
+
+
+class ShardRouter:
+    """
+    Decides whether a message is processed by this node or by another one.
+
+    Routing is by sender id, so all messages of a conversation land on the
+    same node. With no nodes configured every message is local.
+    """
+
+    def __init__(self, nodes: List[str], self_url: Optional[str]):
+        self.self_url = self_url
+        self.ring = HashRing(nodes) if nodes and self_url else None
+        if self.ring and self_url not in self.ring.nodes:
+            raise ValueError(f"SHARD_SELF {self_url} is not one of SHARD_NODES")
+
+    @property
+    def enabled(self) -> bool:
+        return self.ring is not None
+
+    def owner(self, sender_id: Optional[str]) -> Optional[str]:
+        """Returns the owning node of a sender, or None when this node owns it."""
+        if self.ring is None:
+            return None
+        owner = self.ring.owner(sender_id or "")
+        return None if owner == self.self_url else owner
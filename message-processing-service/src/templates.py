@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import os
+import time
+import traceback
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+from dotenv import load_dotenv
+
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+DATA_SERVICE_URL = os.environ["DATA_SERVICE_URL"]
+# Templates younger than TEMPLATE_TTL are served as is; older ones are served
+# while being refreshed in the background, up to TEMPLATE_MAX_STALE
+TEMPLATE_TTL = float(os.getenv("TEMPLATE_TTL", 300))
+TEMPLATE_MAX_STALE = float(os.getenv("TEMPLATE_MAX_STALE", 24 * 3600))
+TEMPLATE_REFRESH_INTERVAL = float(os.getenv("TEMPLATE_REFRESH_INTERVAL", 60))
+
+
+class TemplateEntry:
+    __slots__ = ("template", "version", "fetched_at")
+
+    def __init__(self, template: Optional[Dict[str, Any]], version: Optional[str]):
+        self.template = template
+        self.version = version
+        self.fetched_at = time.monotonic()
+
+
+def _version(template: Dict[str, Any], etag: Optional[str] = None) -> Optional[str]:
+    return etag or template.get("updatedAt") or template.get("updated_at")
+
+
+class TemplateRepository:
+    """
+    Async, in-memory cache of chat templates from the Data Service.
+
+    Every template is stored with its version (the ETag or updatedAt of the
+    document). Templates are preloaded at startup, served from memory with
+    stale-while-revalidate semantics, and a periodic revalidation compares
+    the versions from the template list and refetches only changed ones.
+    """
+
+    def __init__(self, base_url: str, ttl: float = 300.0, max_stale: float = 24 * 3600):
+        self.base_url = base_url
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._entries: Dict[str, TemplateEntry] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Bumped on invalidation, so a fetch started before it does not store stale data
+        self._generation = 0
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def get(self, template_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns a template by id, or None if it does not exist.
+
+        Raises:
+            aiohttp.ClientError: If the template is not cached and the Data Service could not be reached
+        """
+        entry = self._entries.get(template_id)
+        if entry is not None:
+            age = time.monotonic() - entry.fetched_at
+            if age < self.ttl:
+                metrics.inc("template_cache_requests_total", help="Template lookups", result="hit")
+                return entry.template
+            if age < self.max_stale:
+                metrics.inc("template_cache_requests_total", result="stale")
+                self._refresh_in_background(template_id)
+                return entry.template
+
+        metrics.inc("template_cache_requests_total", result="miss")
+        return await self._fetch_shared(template_id)
+
+    def _fetch_shared(self, template_id: str) -> "asyncio.Future":
+        task = self._inflight.get(template_id)
+        if task is None:
+            task = asyncio.create_task(self._fetch(template_id))
+            self._inflight[template_id] = task
+            task.add_done_callback(lambda done: self._forget(template_id, done))
+        return asyncio.shield(task)
+
+    def _forget(self, template_id: str, task: asyncio.Task):
+        # An invalidation may have replaced the fetch with a newer one already
+        if self._inflight.get(template_id) is task:
+            del self._inflight[template_id]
+        # Mark the exception as retrieved in case nobody was waiting any more
+        if not task.cancelled():
+            task.exception()
+
+    def _refresh_in_background(self, template_id: str):
+        if template_id in self._inflight:
+            return
+
+        async def refresh():
+            try:
+                await self._fetch_shared(template_id)
+            except Exception:
+                logger.error(f"Error refreshing template {template_id}: {traceback.format_exc()}")
+
+        asyncio.create_task(refresh())
+
+    async def _fetch(self, template_id: str) -> Optional[Dict[str, Any]]:
+        url = f"{self.base_url}/api/templates"
+        generation = self._generation
+        async with self._get_session().get(url, params={"id": template_id}) as response:
+            if response.status == 200:
+                template = await response.json()
+                if generation == self._generation:
+                    self._entries[template_id] = TemplateEntry(template, _version(template, response.headers.get("ETag")))
+                return template
+            if response.status == 404:
+                logger.warning(f"Template with ID {template_id} not found")
+                if generation == self._generation:
+                    self._entries[template_id] = TemplateEntry(None, None)
+                return None
+            error_text = await response.text()
+            logger.error(f"Error retrieving template {template_id}: {response.status} - {error_text}")
+            return None
+
+    async def _list(self) -> List[Dict[str, Any]]:
+        async with self._get_session().get(f"{self.base_url}/api/templates") as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def preload(self):
+        """
+        Loads all templates into memory.
+        """
+        templates = await self._list()
+        await asyncio.gather(*(self._fetch_shared(template["_id"]) for template in templates), return_exceptions=True)
+        logger.info(f"Preloaded {len(templates)} templates")
+
+    async def revalidate(self):
+        """
+        Refetches templates whose version in the template list differs from the cached one.
+        """
+        templates = await self._list()
+        changed = []
+        for template in templates:
+            entry = self._entries.get(template["_id"])
+            version = _version(template)
+            if entry is None or version is None or entry.version != version:
+                changed.append(template["_id"])
+            else:
+                entry.fetched_at = time.monotonic()
+
+        if changed:
+            await asyncio.gather(*(self._fetch_shared(template_id) for template_id in changed), return_exceptions=True)
+            logger.info(f"Refreshed {len(changed)} templates")
+
+    async def revalidate_periodically(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.revalidate()
+            except Exception:
+                logger.error(f"Error revalidating templates: {traceback.format_exc()}")
+
+    def invalidate(self, template_id: Optional[str] = None):
+        """
+        Drops one template from the cache, or all templates if template_id is None.
+        Fetches already running are no longer shared, so the next lookup fetches the template again.
+        """
+        self._generation += 1
+        if template_id is None:
+            self._entries.clear()
+            self._inflight.clear()
+        else:
+            self._entries.pop(template_id, None)
+            self._inflight.pop(template_id, None)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+template_repository = TemplateRepository(DATA_SERVICE_URL, ttl=TEMPLATE_TTL, max_stale=TEMPLATE_MAX_STALE)
@@ -34,6 +34,8 @@ async def llm_processing(payload: LLMProcessingPayloadPost):
         )
 
         if response.status_code != 200:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
+            # Pass backpressure hints (429/503 + Retry-After) through to the messenger
+            headers = {"Retry-After": response.headers["Retry-After"]} if "Retry-After" in response.headers else None
+            raise HTTPException(status_code=response.status_code, detail=response.text, headers=headers)
 
         return None
\ No newline at end of file
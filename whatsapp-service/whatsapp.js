@@ -62,6 +62,25 @@ client.on('ready', async () => {
 
 });
 
+// Post a message to the processing service, backing off while it sheds load (429/503 + Retry-After)
+const MAX_SUBMIT_ATTEMPTS = 5;
+
+async function submitMessage(messageData) {
+  for (let attempt = 1; ; attempt++) {
+    try {
+      return await axios.post(`${MESSAGE_PROCESSING_SERVICE_URL}/new_message`, messageData);
+    } catch (error) {
+      const status = error.response && error.response.status;
+      if ((status !== 429 && status !== 503) || attempt >= MAX_SUBMIT_ATTEMPTS) {
+        throw error;
+      }
+      const retryAfter = parseInt(error.response.headers['retry-after'], 10) || 2 ** attempt;
+      console.log(`Processing service busy (${status}), retrying message ${messageData.message_id} in ${retryAfter}s`);
+      await new Promise((resolve) => setTimeout(resolve, retryAfter * 1000));
+    }
+  }
+}
+
 // Handle new messages
 client.on('message', async (message) => {
   try {
@@ -115,7 +134,7 @@ client.on('message', async (message) => {
     }
     
     // Send to message processing service
-    await axios.post(`${MESSAGE_PROCESSING_SERVICE_URL}/new_message`, messageData);
+    await submitMessage(messageData);
     console.log(`${isPrivate ? 'Private message' : 'Group message'} from ${messageData.sender_name} forwarded to processing service`);
     
   } catch (error) {